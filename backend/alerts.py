@@ -0,0 +1,384 @@
+import json
+import operator
+import os
+import queue
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .shared_state import get_store
+from .state_store import InProcessStateStore, StateStore
+
+# JSON schema for a single alert rule
+RULE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rule_id": {"type": "string"},
+        "type": {"type": "string", "enum": ["threshold", "rate_of_change", "bitfield", "stale"]},
+        "device_id": {"type": ["string", "null"]},
+        "field": {"type": "string"},
+        # threshold
+        "op": {"type": "string", "enum": [">", ">=", "<", "<=", "==", "!="]},
+        "value": {"type": "number"},
+        # rate_of_change: absolute change per second
+        "max_per_s": {"type": "number", "minimum": 0},
+        # bitfield: (bits & mask) == equals
+        "mask": {"type": "integer", "minimum": 0},
+        "equals": {"type": "integer", "minimum": 0},
+        # stale
+        "max_age_s": {"type": "number", "exclusiveMinimum": 0},
+        "severity": {"type": "string"},
+    },
+    "required": ["rule_id", "type"],
+    "allOf": [
+        {"if": {"properties": {"type": {"const": "threshold"}}},
+         "then": {"required": ["field", "op", "value"]}},
+        {"if": {"properties": {"type": {"const": "rate_of_change"}}},
+         "then": {"required": ["field", "max_per_s"]}},
+        {"if": {"properties": {"type": {"const": "bitfield"}}},
+         "then": {"required": ["field", "mask"]}},
+        {"if": {"properties": {"type": {"const": "stale"}}},
+         "then": {"required": ["max_age_s"]}},
+    ],
+}
+
+_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+_NUMERIC = (int, float)
+_BIN_CHARS = frozenset("01")
+
+WEBHOOK_QUEUE_MAXSIZE = 10000
+
+
+def validate_rules(rules: List[Dict[str, Any]]):
+    from jsonschema import validate  # lazy: keeps API cold start cheap
+
+    ids = set()
+    for rule in rules:
+        validate(instance=rule, schema=RULE_SCHEMA)
+        if rule["rule_id"] in ids:
+            raise ValueError(f"Duplicate rule_id: {rule['rule_id']}")
+        ids.add(rule["rule_id"])
+
+
+# ---------------------------------------------------------------------------
+# Per-rule checks. Each returns (firing, detail) for one parsed value.
+# ---------------------------------------------------------------------------
+def _threshold_check(rule: Dict[str, Any]) -> Callable:
+    cmp = _OPS[rule["op"]]
+    limit = rule["value"]
+
+    def check(value, state, key, now):
+        if type(value) not in _NUMERIC:
+            return False, None
+        return cmp(value, limit), value
+
+    return check
+
+
+def _rate_check(rule: Dict[str, Any]) -> Callable:
+    max_per_s = rule["max_per_s"]
+
+    def check(value, state, key, now):
+        if type(value) not in _NUMERIC:
+            return False, None
+        prev = state.get(key)
+        state[key] = (value, now)
+        if prev is None or now <= prev[1]:
+            return False, None
+        rate = abs(value - prev[0]) / (now - prev[1])
+        return rate > max_per_s, rate
+
+    return check
+
+
+def _bitfield_check(rule: Dict[str, Any]) -> Callable:
+    mask = rule["mask"]
+    equals = rule.get("equals", mask)
+
+    def check(value, state, key, now):
+        # BIN registers are parsed to a string of 0/1 characters
+        if type(value) is not str or not value or not _BIN_CHARS.issuperset(value):
+            return False, None
+        return (int(value, 2) & mask) == equals, value
+
+    return check
+
+
+_CHECK_BUILDERS = {
+    "threshold": _threshold_check,
+    "rate_of_change": _rate_check,
+    "bitfield": _bitfield_check,
+}
+
+
+class CompiledRules:
+    """
+    Rules resolved against one register dictionary.
+
+    Each evaluator holds the row position of the field it reads, so
+    evaluation never touches registers that no rule references. Rules
+    scoped to one device are grouped under that device, so a packet only
+    runs the fleet-wide rules plus its own device's rules.
+    """
+
+    __slots__ = ("global_evaluators", "device_evaluators")
+
+    def __init__(self, global_evaluators: List[Tuple[int, str, Callable, Dict[str, Any]]],
+                 device_evaluators: Dict[str, List[Tuple[int, str, Callable, Dict[str, Any]]]]):
+        self.global_evaluators = global_evaluators
+        self.device_evaluators = device_evaluators
+
+
+def compile_rules(rules: List[Dict[str, Any]], registers: List[Dict[str, Any]]) -> CompiledRules:
+    positions = {reg["short_name"].strip().upper(): i for i, reg in enumerate(registers)}
+    global_evaluators = []
+    device_evaluators: Dict[str, List[Tuple[int, str, Callable, Dict[str, Any]]]] = {}
+    for rule in rules:
+        builder = _CHECK_BUILDERS.get(rule["type"])
+        if builder is None:
+            continue  # stale rules are checked by the sweeper, not per packet
+        pos = positions.get(rule["field"].strip().upper())
+        if pos is None:
+            continue  # field not in this dictionary
+        evaluator = (pos, rule["rule_id"], builder(rule), rule)
+        scope = rule.get("device_id")
+        if scope is None:
+            global_evaluators.append(evaluator)
+        else:
+            device_evaluators.setdefault(scope, []).append(evaluator)
+    return CompiledRules(global_evaluators, device_evaluators)
+
+
+def _group_by_device(rules: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+    fleet, by_device = [], {}
+    for rule in rules:
+        scope = rule.get("device_id")
+        if scope is None:
+            fleet.append(rule)
+        else:
+            by_device.setdefault(scope, []).append(rule)
+    return fleet, by_device
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against parsed packets and dispatches fired alerts.
+
+    An alert fires when a rule goes from OK to violated for a device, and
+    clears when the rule is OK again, so a stuck value does not flood the
+    queue. Fired alerts are recorded in the state store (served by /alerts)
+    and, if ALERT_WEBHOOK_URL is set, POSTed to it from a background thread.
+
+    Every alert is keyed by its episode: rule, device and the time of the
+    packet that started it (for stale rules, the last packet before the
+    silence). The store records each key once, so a sweep repeated by
+    several processes fires once, while a new breach is a new alert.
+
+    Transition and rate_of_change state is per process: under a share group
+    each process only sees its share of a device's packets. Stale checks use
+    the store's last-seen times, so they cover the whole fleet.
+    """
+
+    def __init__(self, webhook_url: Optional[str] = None, sweep_interval: float = 5.0,
+                 store: Optional[StateStore] = None):
+        self.webhook_url = webhook_url
+        self.sweep_interval = sweep_interval
+        self.store = store if store is not None else InProcessStateStore()
+
+        self._lock = threading.Lock()
+        self._rules: List[Dict[str, Any]] = []
+        self._stale_rules: List[Dict[str, Any]] = []
+        self._stale_fleet: List[Dict[str, Any]] = []
+        self._stale_by_device: Dict[str, List[Dict[str, Any]]] = {}
+        self._dictionaries: Dict[str, List[Dict[str, Any]]] = {}
+        self._compiled: Dict[str, CompiledRules] = {}
+
+        self._rule_state: Dict[Tuple[str, str], Any] = {}
+        self._active: set = set()
+        # (device_id, rule_id) -> last_seen of the stale episode already fired
+        self._stale_fired: Dict[Tuple[str, str], float] = {}
+
+        self._outbox: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=WEBHOOK_QUEUE_MAXSIZE)
+        self.dropped = 0
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Configuration
+    # ------------------------------------------------------------------
+    def set_rules(self, rules: List[Dict[str, Any]]):
+        """Replace all rules and recompile them for every known dictionary."""
+        validate_rules(rules)
+        with self._lock:
+            self._rules = list(rules)
+            self._stale_rules = [r for r in rules if r["type"] == "stale"]
+            self._stale_fleet, self._stale_by_device = _group_by_device(self._stale_rules)
+            self._compiled = {
+                key: compile_rules(self._rules, regs)
+                for key, regs in self._dictionaries.items()
+            }
+            self._rule_state.clear()
+            self._active.clear()
+            self._stale_fired.clear()
+
+    def get_rules(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._rules)
+
+    def register_dictionary(self, dict_key: str, registers: List[Dict[str, Any]]):
+        with self._lock:
+            if dict_key in self._dictionaries:
+                return
+            self._dictionaries[dict_key] = registers
+            self._compiled[dict_key] = compile_rules(self._rules, registers)
+
+    # ------------------------------------------------------------------
+    # Hot path
+    # ------------------------------------------------------------------
+    def evaluate(self, dict_key: str, device_id: str, parsed_rows: List[Dict[str, Any]],
+                 now: Optional[float] = None):
+        """Run the compiled rules for `dict_key` against one parsed packet."""
+        if now is None:
+            now = time.time()
+
+        compiled = self._compiled.get(dict_key)
+        if compiled is None:
+            return
+
+        state = self._rule_state
+        active = self._active
+        device_evaluators = compiled.device_evaluators.get(device_id)
+        for evaluators in (compiled.global_evaluators, device_evaluators or ()):
+            for pos, rule_id, check, rule in evaluators:
+                key = (device_id, rule_id)
+                firing, detail = check(parsed_rows[pos]["Value"], state, key, now)
+                if firing:
+                    if key not in active:
+                        active.add(key)
+                        self._fire(rule, device_id, detail, now, f"{rule_id}|{device_id}|{now!r}")
+                elif key in active:
+                    active.discard(key)
+
+    # ------------------------------------------------------------------
+    # Stale devices
+    # ------------------------------------------------------------------
+    def check_stale(self, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            fleet, by_device = self._stale_fleet, self._stale_by_device
+        if not fleet and not by_device:
+            return
+        # One episode per silence: a new packet moves last_seen and re-arms it
+        fired = self._stale_fired
+        for device_id, last_seen in self.store.last_seen().items():
+            if last_seen is None:
+                continue
+            age = now - last_seen
+            for rules in (fleet, by_device.get(device_id, ())):
+                for rule in rules:
+                    key = (device_id, rule["rule_id"])
+                    if age > rule["max_age_s"] and fired.get(key) != last_seen:
+                        fired[key] = last_seen
+                        self._fire(rule, device_id, age, now,
+                                   f"{rule['rule_id']}|{device_id}|stale|{last_seen}")
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+    def _fire(self, rule: Dict[str, Any], device_id: str, detail, now: float, dedup_key: str):
+        alert = {
+            "rule_id": rule["rule_id"],
+            "type": rule["type"],
+            "severity": rule.get("severity", "warning"),
+            "device_id": device_id,
+            "field": rule.get("field"),
+            "value": detail,
+            "fired_at": now,
+        }
+        # Only the process that records the alert sends the webhook
+        if not self.store.add_alert(alert, dedup_key):
+            return
+        if self.webhook_url:
+            try:
+                self._outbox.put_nowait(alert)
+            except queue.Full:
+                self.dropped += 1
+
+    def recent_alerts(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return fired alerts, newest first."""
+        return self.store.get_alerts(limit)
+
+    def _post(self, alert: Dict[str, Any]):
+        req = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(alert).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            urllib.request.urlopen(req, timeout=5).close()
+        except Exception as e:
+            print(f"[ALERTS] Webhook error: {e}")
+
+    def _run(self):
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._stop_event.is_set():
+            try:
+                alert = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                alert = None
+            if alert is not None:
+                self._post(alert)
+            if time.monotonic() >= next_sweep:
+                self.check_stale()
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def start(self):
+        """Start the webhook / stale-device background thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+
+_engine_lock = threading.Lock()
+_engine: Optional[AlertEngine] = None
+
+
+def get_engine() -> AlertEngine:
+    """Return the process-wide alert engine, started on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AlertEngine(
+                    webhook_url=os.getenv("ALERT_WEBHOOK_URL") or None,
+                    store=get_store(),
+                )
+                _engine.start()
+    return _engine
+
+
+def swap_engine(engine: Optional[AlertEngine]) -> Optional[AlertEngine]:
+    """Install `engine` as the process-wide engine; return the previous one."""
+    global _engine
+    with _engine_lock:
+        previous, _engine = _engine, engine
+    return previous
@@ -1,74 +1,466 @@
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import Any, Dict, List
 
-import os
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+# Heavy modules (FastAPI, pydantic, paho, jsonschema) are imported inside
+# create_app() / the worker so that importing this module stays cheap.
 
-from .shared_state import get_latest_data
-from .mqtt_worker import configure_and_start_mqtt
+# Optional: defaults from env vars
+DEFAULT_BROKER = os.getenv("MQTT_BROKER", "ecozen.ai")
+DEFAULT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 
+# Topic used when a bulk /configure entry does not give one
+DEFAULT_TOPIC_TEMPLATE = os.getenv("DEFAULT_TOPIC_TEMPLATE", "/AC/1/{device_id}/Datalog")
 
-print("🔎 Listing project root:")
-print(os.listdir("/opt/render/project/src"))
+# Seconds from process start until every registered device topic is
+# subscribed and acknowledged by its broker, which /health reports against
+READY_TARGET_S = float(os.getenv("READY_TARGET_S", "3.0"))
 
-print("🔎 Listing backend folder:")
-print(os.listdir("/opt/render/project/src/backend"))
+# Seconds after which the replica reports ready even if some broker has not
+# acknowledged yet, so one unreachable broker cannot hold back the others
+# (/health lists the brokers still pending)
+READY_TIMEOUT_S = float(os.getenv("READY_TIMEOUT_S", "30.0"))
 
+_IMPORT_T0 = time.time()
 
-# Optional: defaults from env vars
-DEFAULT_BROKER = os.getenv("MQTT_BROKER", "ecozen.ai")
-DEFAULT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 
-app = FastAPI(title="MQTT AC Parser Backend")
-
-class ConfigurePayload(BaseModel):
-    device_id: str
-    topic: str
-    registers: List[Dict[str, Any]]
-    broker: str | None = None
-    port: int | None = None
-
-@app.get("/")
-def root():
-    return {"status": "backend ok"}
-
-@app.get("/health")
-def health():
-    return {"status": "ok"}
-
-
-@app.post("/configure")
-def configure(payload: ConfigurePayload):
-    broker = payload.broker or DEFAULT_BROKER
-    port = payload.port or DEFAULT_PORT
-
-    if not payload.device_id:
-        raise HTTPException(status_code=400, detail="device_id is required")
-    if not payload.topic:
-        raise HTTPException(status_code=400, detail="topic is required")
-    if not payload.registers:
-        raise HTTPException(status_code=400, detail="registers (dictionary) are required")
-
-    # Start or reconfigure MQTT worker
-    configure_and_start_mqtt(
-        broker=broker,
-        port=port,
-        topic=payload.topic,
-        device_id=payload.device_id,
-        registers=payload.registers,
+def _process_start_time() -> float:
+    """Wall-clock process start time (Linux /proc), falling back to import time."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # Field 22 (starttime) comes after the ")" that closes the comm field
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat", "r") as f:
+            btime = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return btime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return _IMPORT_T0
+
+
+# How often each process checks the shared registry for changes made
+# through another process (devices, dictionaries, alert rules)
+REGISTRY_POLL_S = float(os.getenv("REGISTRY_POLL_S", "2.0"))
+
+# Held while applying the registry and around every save + apply in the
+# handlers, so the follow thread never compares a stale registry read with
+# a newer in-process route (and rolls it back)
+_config_lock = threading.Lock()
+
+
+def _apply_registry() -> int:
+    """
+    Bring this process in line with the registry: compile new dictionaries,
+    route devices that are new or changed, and load the alert rules.
+    Returns the number of devices routed.
+    """
+    from .alerts import get_engine
+    from .config_store import get_registry
+    from .mqtt_worker import configure_devices, device_snapshot, is_registered, register_dictionary
+
+    registry = get_registry()
+    with _config_lock:
+        dictionaries, devices = registry.load()
+        bad = set()
+        for dict_key, dictionary in dictionaries.items():
+            if is_registered(dict_key):
+                continue
+            try:
+                register_dictionary(dictionary["registers"], dict_key, dictionary["checksum"])
+            except Exception as e:
+                bad.add(dict_key)
+                print(f"[REGISTRY] Skipping invalid dictionary {dict_key}: {e}")
+
+        # One bad row must not keep the rest of the fleet from being routed
+        routable = []
+        topic_owner: Dict[str, str] = {}
+        for dev in devices:
+            if dev["dict_hash"] in bad:
+                continue
+            owner = topic_owner.setdefault(dev["topic"], dev["device_id"])
+            if owner != dev["device_id"]:
+                print(f"[REGISTRY] Skipping {dev['device_id']}: topic {dev['topic']} is used by {owner}")
+                continue
+            routable.append(dev)
+
+        current = device_snapshot()
+        changed = [
+            dev for dev in routable
+            if current.get(dev["device_id"]) != (dev["topic"], dev["broker"], dev["port"], dev["dict_hash"])
+        ]
+        skipped = 0
+        if changed:
+            try:
+                configure_devices(changed)
+            except ValueError:
+                # A conflict with a route this process holds; route one by one
+                for dev in changed:
+                    try:
+                        configure_devices([dev])
+                    except ValueError as e:
+                        skipped += 1
+                        print(f"[REGISTRY] Skipping {dev['device_id']}: {e}")
+
+        rules = registry.load_rules()
+        engine = get_engine()
+        if rules is not None and rules != engine.get_rules():
+            try:
+                engine.set_rules(rules)
+            except Exception as e:
+                print(f"[REGISTRY] Skipping invalid rules: {e}")
+    return len(routable) - skipped
+
+
+def _prewarm(state: Dict[str, Any], stop: threading.Event):
+    """
+    Reload the device registry, compile its dictionaries and start ingest.
+    Ready means every broker connection is up and has acknowledged its
+    subscriptions, i.e. packets from every registered device will be ingested.
+    After READY_TIMEOUT_S the replica is marked ready anyway; ready_after_s
+    is still only recorded once every broker has acknowledged.
+    """
+    from .mqtt_worker import all_subscribed, broker_status
+
+    try:
+        state["devices_loaded"] = _apply_registry()
+        state["configured"] = state["devices_loaded"] > 0
+    except Exception as e:
+        print(f"[STARTUP] Could not restore registry: {e}")
+
+    # Wait for CONNACK + SUBACK on every broker, not just spawned threads
+    deadline = time.monotonic() + READY_TIMEOUT_S
+    while True:
+        done = all_subscribed()
+        # Checked after all_subscribed(): stop_mqtt() empties the workers
+        if stop.is_set():
+            return
+        if done:
+            break
+        if not state["ready"] and time.monotonic() >= deadline:
+            state["ready"] = True
+            pending = [b for b, ok in broker_status().items() if not ok]
+            print(f"[STARTUP] Ready after {READY_TIMEOUT_S}s timeout; still waiting for {pending}")
+        stop.wait(0.05)
+
+    state["ready"] = True
+    state["ready_after_s"] = round(time.time() - state["process_start"], 3)
+    print(
+        f"[STARTUP] {state['devices_loaded']} devices ready after "
+        f"{state['ready_after_s']}s (target {READY_TARGET_S}s)"
+    )
+
+
+def _follow_registry(state: Dict[str, Any], stop: threading.Event):
+    """Re-apply the registry whenever another process has changed it."""
+    from .config_store import get_registry
+
+    version = None
+    while not stop.wait(REGISTRY_POLL_S):
+        try:
+            current = get_registry().data_version()
+            if current == version:
+                continue
+            # The first pass may repeat prewarm's work; applying is idempotent
+            version = current
+            state["devices_loaded"] = _apply_registry()
+            state["configured"] = state["configured"] or state["devices_loaded"] > 0
+        except Exception as e:
+            print(f"[REGISTRY] Sync error: {e}")
+
+
+def create_app():
+    """Build the FastAPI application. Use with `uvicorn backend.api:create_app --factory`."""
+    from fastapi import FastAPI, HTTPException, Response
+    from pydantic import BaseModel
+
+    from .alerts import get_engine, validate_rules
+    from .config_store import get_registry
+    from .mqtt_worker import (
+        broker_status,
+        configure_device,
+        configure_devices,
+        install_dictionary,
+        is_registered,
+        prepare_dictionary,
+        stop_mqtt,
     )
+    from .shared_state import get_history, get_latest_data, get_quarantine_counters, get_quarantined
 
-    return {
-        "status": "configured",
-        "broker": broker,
-        "port": port,
-        "topic": payload.topic,
-        "device_id": payload.device_id,
-        "register_count": len(payload.registers),
+    startup_state: Dict[str, Any] = {
+        "process_start": _process_start_time(),
+        "ready": False,
+        "ready_after_s": None,
+        "configured": False,
+        "devices_loaded": 0,
     }
 
+    @asynccontextmanager
+    async def lifespan(app):
+        # Reload in the background so the API answers /health immediately
+        stop = threading.Event()
+        threading.Thread(target=_prewarm, args=(startup_state, stop), daemon=True).start()
+        threading.Thread(
+            target=_follow_registry, args=(startup_state, stop), daemon=True
+        ).start()
+        yield
+        # Before stop_mqtt(), so prewarm never takes the emptied worker list for ready
+        stop.set()
+        stop_mqtt()
+        get_engine().stop()
+
+    app = FastAPI(title="MQTT AC Parser Backend", lifespan=lifespan)
+    app.state.startup = startup_state
+
+    class ConfigurePayload(BaseModel):
+        device_id: str
+        topic: str
+        registers: List[Dict[str, Any]]
+        broker: str | None = None
+        port: int | None = None
+        checksum: Dict[str, Any] | None = None
+
+    class DeviceEntry(BaseModel):
+        device_id: str
+        topic: str | None = None
+        dictionary: str | None = None        # key into BulkConfigurePayload.dictionaries
+        dictionary_hash: str | None = None   # an already registered dictionary
+        broker: str | None = None
+        port: int | None = None
+
+    class BulkConfigurePayload(BaseModel):
+        dictionaries: Dict[str, List[Dict[str, Any]]] = {}
+        checksums: Dict[str, Dict[str, Any]] = {}      # optional, by dictionary key
+        devices: List[DeviceEntry]
+
+    class RulesPayload(BaseModel):
+        rules: List[Dict[str, Any]]
+
+    @app.get("/")
+    def root():
+        return {"status": "backend ok"}
+
+    @app.get("/health")
+    def health():
+        ready_after = startup_state["ready_after_s"]
+        return {
+            "status": "ok",
+            "ready": startup_state["ready"],
+            "configured": startup_state["configured"],
+            "devices_loaded": startup_state["devices_loaded"],
+            "ready_after_s": ready_after,
+            "ready_target_s": READY_TARGET_S,
+            "within_target": ready_after is not None and ready_after <= READY_TARGET_S,
+            "brokers": broker_status(),
+        }
+
+    @app.get("/ready")
+    def ready(response: Response):
+        if not startup_state["ready"]:
+            response.status_code = 503
+        return {"ready": startup_state["ready"]}
+
+    @app.post("/configure")
+    def configure(payload: ConfigurePayload):
+        broker = payload.broker or DEFAULT_BROKER
+        port = payload.port or DEFAULT_PORT
+
+        if not payload.device_id:
+            raise HTTPException(status_code=400, detail="device_id is required")
+        if not payload.topic:
+            raise HTTPException(status_code=400, detail="topic is required")
+        if not payload.registers:
+            raise HTTPException(status_code=400, detail="registers (dictionary) are required")
+
+        # Validate and compile before touching any state
+        try:
+            dict_key, compiled = prepare_dictionary(payload.registers, payload.checksum)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid dictionary: {e}")
+
+        with _config_lock:
+            # Persist so restarts come back configured. The registry rejects
+            # a topic owned by another device inside its write transaction.
+            try:
+                get_registry().save(
+                    {dict_key: {"registers": payload.registers, "checksum": payload.checksum}},
+                    [{
+                        "device_id": payload.device_id,
+                        "topic": payload.topic,
+                        "broker": broker,
+                        "port": port,
+                        "dict_hash": dict_key,
+                    }],
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+            # Start or reconfigure MQTT worker
+            install_dictionary(dict_key, compiled)
+            configure_device(payload.device_id, payload.topic, dict_key, broker, port)
+
+        startup_state["configured"] = True
+
+        return {
+            "status": "configured",
+            "broker": broker,
+            "port": port,
+            "topic": payload.topic,
+            "device_id": payload.device_id,
+            "register_count": len(payload.registers),
+            "dictionary_hash": dict_key,
+        }
+
+    @app.post("/configure/bulk")
+    def configure_bulk(payload: BulkConfigurePayload):
+        if not payload.devices:
+            raise HTTPException(status_code=400, detail="devices are required")
+
+        # Validate everything first; a 400 must leave no state behind.
+        # Each distinct dictionary is validated and compiled once.
+        registry = get_registry()
+        name_to_hash: Dict[str, str] = {}
+        prepared: Dict[str, Any] = {}
+        new_dictionaries: Dict[str, Dict[str, Any]] = {}
+        for name, registers in payload.dictionaries.items():
+            if not registers:
+                raise HTTPException(status_code=400, detail=f"Dictionary {name} is empty")
+            checksum = payload.checksums.get(name)
+            try:
+                dict_key, compiled = prepare_dictionary(registers, checksum)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid dictionary {name}: {e}")
+            name_to_hash[name] = dict_key
+            prepared[dict_key] = compiled
+            new_dictionaries[dict_key] = {"registers": registers, "checksum": checksum}
+
+        devices = []
+        errors = []
+        for entry in payload.devices:
+            if entry.dictionary is not None:
+                dict_key = name_to_hash.get(entry.dictionary)
+            else:
+                dict_key = entry.dictionary_hash
+            if dict_key is not None and dict_key not in prepared and not is_registered(dict_key):
+                # Persisted by another process, or not loaded yet by prewarm
+                stored = registry.get_dictionary(dict_key)
+                if stored is not None:
+                    try:
+                        _, prepared[dict_key] = prepare_dictionary(
+                            stored["registers"], stored["checksum"], dict_key
+                        )
+                    except Exception as e:
+                        errors.append(f"{entry.device_id}: stored dictionary is invalid: {e}")
+                        continue
+            if not entry.device_id:
+                errors.append("device_id is required")
+            elif dict_key is None or (dict_key not in prepared and not is_registered(dict_key)):
+                errors.append(f"{entry.device_id}: unknown dictionary")
+            else:
+                devices.append({
+                    "device_id": entry.device_id,
+                    "topic": entry.topic or DEFAULT_TOPIC_TEMPLATE.format(device_id=entry.device_id),
+                    "broker": entry.broker or DEFAULT_BROKER,
+                    "port": entry.port or DEFAULT_PORT,
+                    "dict_hash": dict_key,
+                })
+
+        # One topic per device: within the payload, and against devices
+        # outside it (a device in the payload may take over a topic that
+        # another device in the payload is moving away from)
+        batch_ids = {dev["device_id"] for dev in devices}
+        topic_to_device: Dict[str, str] = {}
+        seen_ids = set()
+        for dev in devices:
+            if dev["device_id"] in seen_ids:
+                errors.append(f"{dev['device_id']}: listed more than once")
+            seen_ids.add(dev["device_id"])
+            other = topic_to_device.setdefault(dev["topic"], dev["device_id"])
+            if other != dev["device_id"]:
+                errors.append(f"{dev['device_id']}: topic {dev['topic']} also given to {other}")
+        for topic, owner in registry.topic_owners(topic_to_device).items():
+            if owner not in batch_ids:
+                errors.append(f"{topic_to_device[topic]}: topic {topic} is already used by {owner}")
+
+        if errors:
+            raise HTTPException(
+                status_code=400,
+                detail={"error_count": len(errors), "errors": errors[:20]},
+            )
+
+        # The checks above give a full error list; save() repeats the owner
+        # check atomically in case another request took a topic meanwhile
+        with _config_lock:
+            try:
+                registry.save(new_dictionaries, devices)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            for dict_key, compiled in prepared.items():
+                install_dictionary(dict_key, compiled)
+            configure_devices(devices)
+
+        startup_state["configured"] = True
+
+        return {
+            "status": "configured",
+            "device_count": len(devices),
+            "dictionaries": name_to_hash,
+        }
+
+    @app.get("/quarantine")
+    def quarantine(device_id: str | None = None, limit: int = 100):
+        if limit < 1 or limit > 1000:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+        return {"counters": get_quarantine_counters(), "packets": get_quarantined(device_id, limit)}
+
+    @app.get("/devices")
+    def devices():
+        return get_registry().list_devices()
+
+    @app.get("/latest")
+    def latest(device_id: str | None = None):
+        data = get_latest_data(device_id)
+        return data
+
+    @app.get("/history")
+    def history(device_id: str | None = None, limit: int = 100):
+        if limit < 1 or limit > 2000:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 2000")
+        return get_history(device_id, limit)
+
+    @app.post("/rules")
+    def set_rules(payload: RulesPayload):
+        try:
+            validate_rules(payload.rules)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid rules: {e}")
+        # Persist first: the other backend processes pick the rules up from there
+        with _config_lock:
+            get_registry().save_rules(payload.rules)
+            get_engine().set_rules(payload.rules)
+        return {"status": "rules updated", "rule_count": len(payload.rules)}
+
+    @app.get("/rules")
+    def get_rules():
+        return get_engine().get_rules()
+
+    @app.get("/alerts")
+    def alerts(limit: int = 100):
+        if limit < 1 or limit > 1000:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+        return get_engine().recent_alerts(limit)
+
+    return app
+
+
+_app = None
+
 
-@app.get("/latest")
-def latest():
-    data = get_latest_data()
-    return data
+def __getattr__(name: str):
+    # Keep `uvicorn backend.api:app` working: build the app on first access.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
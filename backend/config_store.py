@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Devices, their dictionaries and the alert rules, reloaded at startup so a
+# new replica can start ingesting without someone re-uploading the Excel
+# dictionaries. Every backend process must point at the same file.
+REGISTRY_PATH = os.getenv("REGISTRY_DB_PATH", "parser_registry.db")
+
+
+class DeviceRegistry:
+    """
+    SQLite registry of devices, register dictionaries and alert rules.
+
+    Dictionaries are stored once per content hash; devices only reference
+    the hash, so a fleet sharing one dictionary stores it a single time.
+    Other processes notice changes through data_version().
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or REGISTRY_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                dict_hash TEXT PRIMARY KEY,
+                registers TEXT NOT NULL,
+                checksum TEXT
+            );
+            CREATE TABLE IF NOT EXISTS devices (
+                device_id TEXT PRIMARY KEY,
+                topic TEXT NOT NULL,
+                broker TEXT NOT NULL,
+                port INTEGER NOT NULL,
+                dict_hash TEXT NOT NULL REFERENCES dictionaries (dict_hash)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS devices_topic ON devices (topic);
+            CREATE TABLE IF NOT EXISTS rules (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                rules TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def save(self, dictionaries: Dict[str, Dict[str, Any]], devices: List[Dict[str, Any]]):
+        """
+        Insert new dictionaries and upsert devices in one transaction.
+
+        `dictionaries` maps hash -> {"registers": [...], "checksum": {...} | None}.
+        A topic may move between devices of the batch, but one owned by a
+        device outside it raises ValueError and nothing is saved. The check
+        runs inside the write transaction, so concurrent saves from other
+        threads or processes cannot both claim a topic.
+        """
+        batch_ids = [d["device_id"] for d in devices]
+        with self._lock, self._conn:
+            # Take the write lock up front so the owner check below stays true
+            self._conn.execute("BEGIN IMMEDIATE")
+            owners = self._topic_owners_locked([d["topic"] for d in devices])
+            batch = set(batch_ids)
+            conflicts = [
+                f"topic {topic} is already used by {owner}"
+                for topic, owner in owners.items() if owner not in batch
+            ]
+            if conflicts:
+                raise ValueError("; ".join(conflicts))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO dictionaries (dict_hash, registers, checksum) VALUES (?, ?, ?)",
+                [
+                    (
+                        h,
+                        json.dumps(d["registers"]),
+                        json.dumps(d["checksum"]) if d.get("checksum") else None,
+                    )
+                    for h, d in dictionaries.items()
+                ],
+            )
+            # Delete then insert: INSERT OR REPLACE would silently delete any
+            # other row holding the topic instead of failing on the index
+            self._conn.executemany(
+                "DELETE FROM devices WHERE device_id = ?", [(d,) for d in batch_ids]
+            )
+            try:
+                self._conn.executemany(
+                    "INSERT INTO devices (device_id, topic, broker, port, dict_hash) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (d["device_id"], d["topic"], d["broker"], int(d["port"]), d["dict_hash"])
+                        for d in devices
+                    ],
+                )
+            except sqlite3.IntegrityError as e:
+                # e.g. two devices of the batch given the same topic
+                raise ValueError(f"Invalid device batch: {e}") from e
+
+    def load(self) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+        """Return (dictionaries by hash, devices)."""
+        with self._lock:
+            dict_rows = self._conn.execute(
+                "SELECT dict_hash, registers, checksum FROM dictionaries"
+            ).fetchall()
+            device_rows = self._conn.execute(
+                "SELECT device_id, topic, broker, port, dict_hash FROM devices"
+            ).fetchall()
+        dictionaries = {
+            h: {"registers": json.loads(regs), "checksum": json.loads(cs) if cs else None}
+            for h, regs, cs in dict_rows
+        }
+        devices = [
+            {"device_id": d, "topic": t, "broker": b, "port": p, "dict_hash": h}
+            for d, t, b, p, h in device_rows
+        ]
+        return dictionaries, devices
+
+    def get_dictionary(self, dict_hash: str) -> Optional[Dict[str, Any]]:
+        """Return {"registers", "checksum"} for a stored hash, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT registers, checksum FROM dictionaries WHERE dict_hash = ?", (dict_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"registers": json.loads(row[0]), "checksum": json.loads(row[1]) if row[1] else None}
+
+    def topic_owners(self, topics: List[str]) -> Dict[str, str]:
+        """Return {topic: device_id} for the given topics that are already in use."""
+        with self._lock:
+            return self._topic_owners_locked(topics)
+
+    def _topic_owners_locked(self, topics: List[str]) -> Dict[str, str]:
+        owners: Dict[str, str] = {}
+        topics = list(topics)
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(topics), 500):
+            chunk = topics[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT topic, device_id FROM devices WHERE topic IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            owners.update(rows)
+        return owners
+
+    def save_rules(self, rules: List[Dict[str, Any]]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rules (id, rules) VALUES (1, ?)", (json.dumps(rules),)
+            )
+
+    def load_rules(self) -> Optional[List[Dict[str, Any]]]:
+        """Return the stored alert rules, or None if none were ever set."""
+        with self._lock:
+            row = self._conn.execute("SELECT rules FROM rules WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def data_version(self) -> int:
+        """Changes whenever another connection (e.g. another process) commits."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def list_devices(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT device_id, topic, broker, port, dict_hash FROM devices ORDER BY device_id"
+            ).fetchall()
+        return [
+            {"device_id": d, "topic": t, "broker": b, "port": p, "dict_hash": h}
+            for d, t, b, p, h in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_registry_lock = threading.Lock()
+_registry: Optional[DeviceRegistry] = None
+
+
+def get_registry() -> DeviceRegistry:
+    """Return the process-wide device registry, opened on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = DeviceRegistry()
+    return _registry
@@ -1,66 +1,372 @@
+import os
 import threading
-import time
-from typing import List, Dict, Any, Optional
-
-from paho.mqtt import client as mqtt
-
-from .parser_logic import parse_packet, validate_registers
-from .shared_state import update_latest
-
-# Global worker state
-_worker_thread: Optional[threading.Thread] = None
-_stop_event = threading.Event()
-
-_current_config_lock = threading.Lock()
-_current_config: Dict[str, Any] = {
-    "broker": None,
-    "port": 1883,
-    "topic": None,
-    "device_id": None,
-    "registers": None,
-}
-
-def _mqtt_loop():
-    """Background loop that connects to MQTT and listens for messages."""
-    global _stop_event
-
-    with _current_config_lock:
-        broker = _current_config["broker"]
-        port = _current_config["port"]
-        topic = _current_config["topic"]
-        device_id = _current_config["device_id"]
-        registers = _current_config["registers"]
-
-    if not broker or not topic or not registers:
-        # Misconfigured
-        return
+from typing import List, Dict, Any, Optional, Tuple
+
+from .alerts import get_engine
+from .parser_logic import (
+    CompiledDictionary,
+    dictionary_hash,
+    validate_checksum,
+    validate_registers,
+)
+from .shared_state import record_quarantine, update_latest
+
+# Set MQTT_SHARE_GROUP to let several backend processes split one topic
+# between them via a shared subscription ($share/<group>/<topic>). Those
+# processes must share STATE_STORE=sqlite and REGISTRY_DB_PATH; each one
+# follows the registry, so a /configure on any of them reaches all.
+SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "").strip()
+
+RECONNECT_DELAY_S = 5.0
+
+# Routing tables, read by the MQTT threads on every message.
+# Updates replace whole entries so readers never see a half-written route.
+_routes_lock = threading.Lock()
+_routes: Dict[str, Tuple[str, str]] = {}           # topic -> (device_id, dict_key)
+_device_topics: Dict[str, str] = {}                # device_id -> topic
+_device_brokers: Dict[str, Tuple[str, int]] = {}   # device_id -> (broker, port)
+_dictionaries: Dict[str, CompiledDictionary] = {}  # dict_key -> compiled dictionary
+_wildcard_filters: Tuple[str, ...] = ()            # routes containing + or #
+
+_workers_lock = threading.Lock()
+_workers: Dict[Tuple[str, int], "BrokerWorker"] = {}
+
+
+def subscription_topic(topic: str) -> str:
+    """Topic filter to subscribe with, shared across processes if configured."""
+    if SHARE_GROUP:
+        return f"$share/{SHARE_GROUP}/{topic}"
+    return topic
+
+
+def is_wildcard(topic: str) -> bool:
+    return "+" in topic or "#" in topic
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT topic filter matching (+ matches one level, # the rest)."""
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _match_route(topic: str) -> Optional[Tuple[str, str]]:
+    route = _routes.get(topic)
+    if route is None:
+        # Devices configured with a wildcard filter (e.g. /AC/1/+/Datalog)
+        for topic_filter in _wildcard_filters:
+            if topic_matches(topic_filter, topic):
+                return _routes.get(topic_filter)
+    return route
+
+
+def ingest(topic: str, raw: str):
+    """Parse one packet for the device registered on `topic` and publish it."""
+    route = _match_route(topic)
+    if route is None:
+        return None
+    device_id, dict_key = route
+    parsed_rows, reason = _dictionaries[dict_key].parse(raw)
+    if reason is not None:
+        # Malformed: keep it out of latest/history and the alert engine
+        record_quarantine(device_id, topic, raw, reason)
+        return None
+    update_latest(raw, parsed_rows, device_id, topic)
+    get_engine().evaluate(dict_key, device_id, parsed_rows)
+    return parsed_rows
+
 
-    client = mqtt.Client()
+class BrokerWorker:
+    """One MQTT connection per broker, subscribed to every registered device topic."""
 
-    def on_connect(client, userdata, flags, rc):
-        # Subscribe to topic
-        client.subscribe(topic)
+    def __init__(self, broker: str, port: int):
+        self.broker = broker
+        self.port = port
+        self._topics: set = set()
+        # Ordered sets (dicts) of topics not yet sent to the broker
+        self._pending_sub: Dict[str, None] = {}
+        self._pending_unsub: Dict[str, None] = {}
+        self._inflight: set = set()   # SUBSCRIBE message ids awaiting SUBACK
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Set while connected with every topic acknowledged by the broker
+        self.subscribed = threading.Event()
 
-    def on_message(client, userdata, msg):
-        raw = msg.payload.decode("utf-8", "ignore")
-        parsed_rows = parse_packet(raw, registers)
-        update_latest(raw, parsed_rows, device_id, topic)
+    def add_topic(self, topic: str):
+        with self._lock:
+            if topic in self._topics:
+                return
+            self._topics.add(topic)
+            if topic in self._pending_unsub:
+                # Removed and re-added before the UNSUBSCRIBE went out: the
+                # broker still has it, so there is nothing to send
+                del self._pending_unsub[topic]
+                return
+            self._pending_sub[topic] = None
+            self.subscribed.clear()
+
+    def remove_topic(self, topic: str):
+        with self._lock:
+            if topic not in self._topics:
+                return
+            self._topics.discard(topic)
+            if topic in self._pending_sub:
+                # Never sent, so never subscribed
+                del self._pending_sub[topic]
+                return
+            self._pending_unsub[topic] = None
+
+    def _flush_subscriptions(self, client):
+        with self._lock:
+            subs, self._pending_sub = self._pending_sub, {}
+            unsubs, self._pending_unsub = self._pending_unsub, {}
+        # Unsubscribe first: the broker applies requests in order, so a topic
+        # unsubscribed and subscribed again ends up subscribed
+        for t in unsubs:
+            client.unsubscribe(subscription_topic(t))
+        if subs:
+            _, mid = client.subscribe([(subscription_topic(t), 0) for t in subs])
+            with self._lock:
+                self._inflight.add(mid)
+        with self._lock:
+            if not self._pending_sub and not self._inflight:
+                self.subscribed.set()
+
+    def _loop(self):
+        """Background loop that connects to MQTT and listens for messages."""
+        # Imported here so the API can start without loading paho
+        from paho.mqtt import client as mqtt
+
+        client = mqtt.Client()
+
+        def on_connect(client, userdata, flags, rc):
+            # (Re)subscribe to every topic on each connect
+            with self._lock:
+                self._pending_sub = dict.fromkeys(self._topics)
+                self._pending_unsub = {}
+                self._inflight.clear()
+                self.subscribed.clear()
+
+        def on_subscribe(client, userdata, mid, granted_qos):
+            with self._lock:
+                self._inflight.discard(mid)
+                if not self._pending_sub and not self._inflight:
+                    self.subscribed.set()
+
+        def on_message(client, userdata, msg):
+            raw = msg.payload.decode("utf-8", "ignore")
+            try:
+                ingest(msg.topic, raw)
+            except Exception as e:
+                # paho re-raises callback errors, which would end this loop
+                # for every device on the broker
+                print(f"[MQTT] Ingest error on {msg.topic}: {e}")
+
+        client.on_connect = on_connect
+        client.on_subscribe = on_subscribe
+        client.on_message = on_message
+
+        # Keep retrying so a broker outage doesn't drop every device on it
+        while not self._stop_event.is_set():
+            try:
+                client.connect(self.broker, self.port, 60)
+                break
+            except Exception as e:
+                print(f"[MQTT] Connection error ({self.broker}:{self.port}): {e}")
+                self._stop_event.wait(RECONNECT_DELAY_S)
+        else:
+            return
+
+        # Main loop
+        while not self._stop_event.is_set():
+            rc = client.loop(timeout=1.0)
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                self.subscribed.clear()
+                self._stop_event.wait(RECONNECT_DELAY_S)
+                try:
+                    client.reconnect()
+                except Exception as e:
+                    print(f"[MQTT] Reconnect error ({self.broker}:{self.port}): {e}")
+                continue
+            if client.is_connected():
+                self._flush_subscriptions(client)
+
+        client.disconnect()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+
+def prepare_dictionary(
+    registers: List[Dict[str, Any]],
+    checksum: Optional[Dict[str, Any]] = None,
+    dict_key: Optional[str] = None,
+) -> Tuple[str, CompiledDictionary]:
+    """Validate and compile a register list without registering it."""
+    dict_key = dict_key or dictionary_hash(registers, checksum)
+    compiled = _dictionaries.get(dict_key)
+    if compiled is not None:
+        return dict_key, compiled
+    validate_registers(registers)
+    if checksum is not None:
+        validate_checksum(checksum)
+    return dict_key, CompiledDictionary(registers, checksum)
 
-    client.on_connect = on_connect
-    client.on_message = on_message
 
-    try:
-        client.connect(broker, port, 60)
-    except Exception as e:
-        print(f"[MQTT] Connection error: {e}")
+def install_dictionary(dict_key: str, compiled: CompiledDictionary):
+    """Make a prepared dictionary available to ingest and the alert engine."""
+    if dict_key in _dictionaries:
         return
+    get_engine().register_dictionary(dict_key, compiled.registers)
+    _dictionaries[dict_key] = compiled
+
+
+def register_dictionary(
+    registers: List[Dict[str, Any]],
+    dict_key: Optional[str] = None,
+    checksum: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Validate and compile a register list once; return its content hash."""
+    dict_key, compiled = prepare_dictionary(registers, checksum, dict_key)
+    install_dictionary(dict_key, compiled)
+    return dict_key
+
 
-    # Main loop
-    while not _stop_event.is_set():
-        client.loop(timeout=1.0)
-        time.sleep(0.1)
+def is_registered(dict_key: str) -> bool:
+    return dict_key in _dictionaries
+
+
+def add_routes(routes: List[Tuple[str, str, str]]) -> List[Tuple[Optional[str], Optional[Tuple[str, int]]]]:
+    """
+    Route packets for a batch of (device_id, topic, dict_key) without
+    touching any broker connection. A topic may move between devices of
+    the same batch, but taking one owned by a device outside the batch is
+    an error and nothing is changed. Returns each device's previous
+    (topic, broker).
+    """
+    global _wildcard_filters
 
-    client.disconnect()
+    for device_id, topic, dict_key in routes:
+        if dict_key not in _dictionaries:
+            raise ValueError(f"Unknown dictionary: {dict_key}")
+
+    with _routes_lock:
+        batch = {device_id: topic for device_id, topic, _ in routes}
+        if len(batch) != len(routes):
+            raise ValueError("A device is listed more than once")
+        owners: Dict[str, str] = {}
+        for device_id, topic, _ in routes:
+            if topic in owners:
+                raise ValueError(f"Topic {topic} given to both {owners[topic]} and {device_id}")
+            owners[topic] = device_id
+            current = _routes.get(topic)
+            if current is not None and current[0] != device_id and current[0] not in batch:
+                raise ValueError(f"Topic {topic} is already used by {current[0]}")
+
+        previous = []
+        wildcard_changed = False
+        for device_id, topic, _ in routes:
+            old_topic = _device_topics.get(device_id)
+            previous.append((old_topic, _device_brokers.get(device_id)))
+            if old_topic is not None and old_topic != topic and _routes.get(old_topic, (None,))[0] == device_id:
+                _routes.pop(old_topic)
+                wildcard_changed = wildcard_changed or is_wildcard(old_topic)
+        for device_id, topic, dict_key in routes:
+            _routes[topic] = (device_id, dict_key)
+            _device_topics[device_id] = topic
+            wildcard_changed = wildcard_changed or is_wildcard(topic)
+        if wildcard_changed:
+            _wildcard_filters = tuple(t for t in _routes if is_wildcard(t))
+    return previous
+
+
+def add_route(device_id: str, topic: str, dict_key: str) -> Tuple[Optional[str], Optional[Tuple[str, int]]]:
+    """Route one device; see add_routes()."""
+    return add_routes([(device_id, topic, dict_key)])[0]
+
+
+def remove_routes(device_ids: List[str]):
+    """Stop routing (and unsubscribe) the given devices."""
+    global _wildcard_filters
+
+    removed = []
+    with _routes_lock:
+        for device_id in device_ids:
+            topic = _device_topics.pop(device_id, None)
+            target = _device_brokers.pop(device_id, None)
+            if topic is not None and _routes.get(topic, (None,))[0] == device_id:
+                _routes.pop(topic)
+                removed.append((topic, target))
+        if any(is_wildcard(topic) for topic, _ in removed):
+            _wildcard_filters = tuple(t for t in _routes if is_wildcard(t))
+    with _workers_lock:
+        for topic, target in removed:
+            worker = _workers.get(target) if target is not None else None
+            if worker is not None:
+                worker.remove_topic(topic)
+
+
+def configure_devices(devices: List[Dict[str, Any]]):
+    """
+    Route a batch of devices ({device_id, topic, dict_hash, broker, port})
+    using already registered dictionaries, and make sure the broker
+    connections for them are running.
+    """
+    previous = add_routes([(d["device_id"], d["topic"], d["dict_hash"]) for d in devices])
+    targets = [(d["broker"], int(d["port"])) for d in devices]
+    with _routes_lock:
+        for dev, target in zip(devices, targets):
+            _device_brokers[dev["device_id"]] = target
+
+    with _workers_lock:
+        # Unsubscribe everything that moved before subscribing, so a topic
+        # handed from one device to another stays subscribed
+        for dev, target, (old_topic, old_broker) in zip(devices, targets, previous):
+            if old_broker is not None and (old_topic != dev["topic"] or old_broker != target):
+                new_owner = _routes.get(old_topic)
+                if new_owner is not None and _device_brokers.get(new_owner[0]) == old_broker:
+                    continue  # handed to another device on the same broker
+                old_worker = _workers.get(old_broker)
+                if old_worker is not None:
+                    old_worker.remove_topic(old_topic)
+        started = set()
+        for dev, target in zip(devices, targets):
+            worker = _workers.get(target)
+            if worker is None:
+                worker = BrokerWorker(*target)
+                _workers[target] = worker
+            worker.add_topic(dev["topic"])
+            if target not in started:
+                worker.start()
+                started.add(target)
+
+
+def configure_device(device_id: str, topic: str, dict_key: str, broker: str, port: int):
+    """Route one device and start its broker connection; see configure_devices()."""
+    configure_devices([{
+        "device_id": device_id,
+        "topic": topic,
+        "dict_hash": dict_key,
+        "broker": broker,
+        "port": port,
+    }])
 
 
 def configure_and_start_mqtt(
@@ -69,30 +375,55 @@ def configure_and_start_mqtt(
     topic: str,
     device_id: str,
     registers: List[Dict[str, Any]],
+    checksum: Optional[Dict[str, Any]] = None,
 ):
     """
     Called by the API when user updates configuration (topic/device/dictionary).
-    Stops any existing worker and starts a new one.
+    Adds or updates the device; other configured devices keep running.
     """
-    global _worker_thread, _stop_event
+    dict_key = register_dictionary(registers, checksum=checksum)
+    configure_device(device_id, topic, dict_key, broker, port)
+    return dict_key
 
-    # Validate registers
-    validate_registers(registers)
 
-    # Stop existing worker if running
-    if _worker_thread and _worker_thread.is_alive():
-        _stop_event.set()
-        _worker_thread.join(timeout=2)
-
-    # Update config
-    with _current_config_lock:
-        _current_config["broker"] = broker
-        _current_config["port"] = int(port)
-        _current_config["topic"] = topic
-        _current_config["device_id"] = device_id
-        _current_config["registers"] = registers
-
-    # Start new worker
-    _stop_event = threading.Event()
-    _worker_thread = threading.Thread(target=_mqtt_loop, daemon=True)
-    _worker_thread.start()
+def device_snapshot() -> Dict[str, Tuple[str, str, int, str]]:
+    """Return {device_id: (topic, broker, port, dict_key)} as routed in this process."""
+    with _routes_lock:
+        return {
+            device_id: (topic, *_device_brokers[device_id], _routes[topic][1])
+            for device_id, topic in _device_topics.items()
+            if device_id in _device_brokers and topic in _routes
+        }
+
+
+def all_subscribed() -> bool:
+    """True once every broker connection has its topics acknowledged."""
+    with _workers_lock:
+        workers = list(_workers.values())
+    return all(worker.subscribed.is_set() for worker in workers)
+
+
+def broker_status() -> Dict[str, bool]:
+    """Return {"broker:port": subscribed} for every broker connection."""
+    with _workers_lock:
+        workers = list(_workers.values())
+    return {f"{w.broker}:{w.port}": w.subscribed.is_set() for w in workers}
+
+
+def stop_mqtt():
+    """
+    Stop every broker connection and forget the device routes (called on
+    API shutdown), so a later start restores everything from the registry.
+    """
+    global _wildcard_filters
+
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+        with _routes_lock:
+            _routes.clear()
+            _device_topics.clear()
+            _device_brokers.clear()
+            _wildcard_filters = ()
+    for worker in workers:
+        worker.stop()
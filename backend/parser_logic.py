@@ -1,6 +1,7 @@
-import jsonschema
-from jsonschema import validate
-from typing import List, Dict, Any
+import hashlib
+import json
+
+from typing import List, Dict, Any, Optional, Tuple
 
 # JSON schema for a single register entry
 REGISTER_SCHEMA = {
@@ -19,12 +20,66 @@ REGISTER_SCHEMA = {
 
 def validate_register(reg: Dict[str, Any]):
     """Validate a register dict against the schema."""
+    from jsonschema import validate  # lazy: keeps API cold start cheap
+
     validate(instance=reg, schema=REGISTER_SCHEMA)
 
+# Optional per-dictionary checksum: the hex bytes in raw[data_from:index]
+# must match the checksum field stored in raw[index:total_upto].
+# The field must be exactly as wide as the algorithm's output.
+CHECKSUM_SIZES = {"sum8": 1, "xor8": 1, "crc16_modbus": 2}  # bytes
+
+CHECKSUM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": list(CHECKSUM_SIZES)},
+        "index": {"type": "integer", "minimum": 0},
+        "total_upto": {"type": "integer", "minimum": 1},
+        "size": {"type": "integer", "minimum": 1},
+        "data_from": {"type": "integer", "minimum": 0},
+        "byteorder": {"type": "string", "enum": ["big", "little"]},
+    },
+    "required": ["type", "index", "total_upto"],
+    "allOf": [
+        {"if": {"properties": {"type": {"const": name}}},
+         "then": {"properties": {"size": {"const": size}}}}
+        for name, size in CHECKSUM_SIZES.items()
+    ],
+}
+
+_HEX_CHARS = frozenset("0123456789abcdefABCDEF")
+
 def validate_registers(registers: List[Dict[str, Any]]):
     for reg in registers:
         validate_register(reg)
 
+def validate_checksum(checksum: Dict[str, Any]):
+    from jsonschema import validate  # lazy: keeps API cold start cheap
+
+    validate(instance=checksum, schema=CHECKSUM_SCHEMA)
+    check_checksum_range(checksum)
+
+def check_checksum_range(checksum: Dict[str, Any]):
+    """Range checks the schema cannot express (they compare fields)."""
+    size = CHECKSUM_SIZES.get(checksum["type"])
+    if size is None:
+        raise ValueError(f"Unknown checksum type: {checksum['type']}")
+    if checksum["total_upto"] - checksum["index"] != size * 2:
+        raise ValueError(
+            f"{checksum['type']} checksum field must be {size * 2} hex chars "
+            f"(index {checksum['index']} .. total_upto {checksum['total_upto']})"
+        )
+    if checksum.get("data_from", 0) > checksum["index"]:
+        raise ValueError("Invalid checksum range (data_from > index)")
+    if (checksum["index"] - checksum.get("data_from", 0)) % 2:
+        raise ValueError("Checksum data range must cover whole hex bytes")
+
+def dictionary_hash(registers: List[Dict[str, Any]], checksum: Optional[Dict[str, Any]] = None) -> str:
+    """Content hash of a register list; identical dictionaries share one hash."""
+    content = registers if checksum is None else {"registers": registers, "checksum": checksum}
+    blob = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
 def parse_value(raw_val: str, fmt: str, signed: bool, scaling: float, offset: float, size: int):
 
     if raw_val is None or raw_val == "":
@@ -36,17 +91,14 @@ def parse_value(raw_val: str, fmt: str, signed: bool, scaling: float, offset: fl
         return raw_val
 
     if fmt == "BIN":
-        try:
-            num = int(raw_val, 16)
-            return format(num, 'b')
-        except:
+        if not _HEX_CHARS.issuperset(raw_val):
             return raw_val
+        return format(int(raw_val, 16), 'b')
 
     if fmt == "DEC":
-        try:
-            num = int(raw_val, 16)   # 👈 always hex
-        except:
+        if not _HEX_CHARS.issuperset(raw_val):
             return raw_val
+        num = int(raw_val, 16)   # 👈 always hex
 
         # ✅ Apply signed logic
         if signed:
@@ -65,8 +117,6 @@ def parse_packet(raw_packet: str, registers):
 
     rows = []
 
-    print("Packet length:", len(raw_packet))
-
     raw_packet = raw_packet.rstrip("\n")
 
     for reg in registers:
@@ -93,3 +143,144 @@ def parse_packet(raw_packet: str, registers):
         })
 
     return rows
+
+
+def _sum8(data: bytes) -> int:
+    return sum(data) & 0xFF
+
+def _xor8(data: bytes) -> int:
+    acc = 0
+    for b in data:
+        acc ^= b
+    return acc
+
+def _crc16_modbus(data: bytes) -> int:
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+_CHECKSUM_FUNCS = {
+    "sum8": _sum8,
+    "xor8": _xor8,
+    "crc16_modbus": _crc16_modbus,
+}
+
+
+def compute_checksum(checksum_type: str, data: bytes) -> int:
+    """Checksum of `data` with one of the CHECKSUM_SIZES algorithms."""
+    return _CHECKSUM_FUNCS[checksum_type](data)
+
+
+def apply_checksum(checksum: Dict[str, Any], raw_packet: str) -> str:
+    """
+    Return `raw_packet` with its checksum field filled in, i.e. the packet
+    a device would send. The checksum spec is validated the same way as
+    for CompiledDictionary.
+    """
+    check_checksum_range(checksum)
+    start, index, end = checksum.get("data_from", 0), checksum["index"], checksum["total_upto"]
+    value = compute_checksum(checksum["type"], bytes.fromhex(raw_packet[start:index]))
+    field = value.to_bytes((end - index) // 2, checksum.get("byteorder", "big"))
+    return raw_packet[:index] + field.hex().upper() + raw_packet[end:]
+
+
+class CompiledDictionary:
+    """
+    A register list prepared for the ingest hot path.
+
+    The expected packet length (the furthest `total_upto`) and per-register
+    slices are computed once, so a short packet is rejected with a single
+    length comparison before any decoding. Hex fields are checked by
+    character set instead of try/except, so malformed packets never raise.
+    """
+
+    def __init__(self, registers: List[Dict[str, Any]], checksum: Optional[Dict[str, Any]] = None):
+        self.registers = registers
+        self.checksum = checksum
+        self.expected_length = max(
+            [reg["total_upto"] for reg in registers]
+            + ([checksum["total_upto"]] if checksum else [])
+        )
+        self._fields = [
+            (reg["short_name"], reg["index"], reg["total_upto"], reg["format"],
+             reg["signed"], reg["scaling"], reg["offset"])
+            for reg in registers
+        ]
+        if checksum:
+            # Guarantees check() only ever sees whole, correctly sized hex fields
+            check_checksum_range(checksum)
+            self._cs_func = _CHECKSUM_FUNCS[checksum["type"]]
+            self._cs_from = checksum.get("data_from", 0)
+            self._cs_index = checksum["index"]
+            self._cs_end = checksum["total_upto"]
+            self._cs_little = checksum.get("byteorder", "big") == "little"
+
+    def check(self, raw_packet: str) -> Optional[str]:
+        """Return None if the packet passes the integrity checks, else a reason."""
+        if len(raw_packet) < self.expected_length:
+            return "short_packet"
+        if self.checksum is None:
+            return None
+
+        data = raw_packet[self._cs_from:self._cs_index]
+        field = raw_packet[self._cs_index:self._cs_end]
+        # Length is already >= expected, so both slices are full width
+        if not _HEX_CHARS.issuperset(data) or not _HEX_CHARS.issuperset(field):
+            return "bad_checksum"
+        expected = bytes.fromhex(field)
+        expected = int.from_bytes(expected, "little" if self._cs_little else "big")
+        if self._cs_func(bytes.fromhex(data)) != expected:
+            return "bad_checksum"
+        return None
+
+    def parse(self, raw_packet: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+        """
+        Validate and decode one packet.
+
+        Returns (rows, None) on success or (None, reason) for a malformed
+        packet. Rows have the same shape as `parse_packet`.
+        """
+        raw_packet = raw_packet.rstrip("\n")
+
+        reason = self.check(raw_packet)
+        if reason is not None:
+            return None, reason
+
+        hex_chars = _HEX_CHARS
+        rows = []
+        for name, idx, end, fmt, signed, scaling, offset in self._fields:
+            segment = raw_packet[idx:end]
+            raw_val = segment.strip()
+
+            if not raw_val:
+                value = None
+            elif fmt == "DEC":
+                if not hex_chars.issuperset(raw_val):
+                    return None, f"bad_field:{name}"
+                num = int(raw_val, 16)
+                if signed:
+                    bits = len(raw_val) * 4
+                    if num >= 1 << (bits - 1):
+                        num -= 1 << bits
+                value = num * scaling + offset
+            elif fmt == "BIN":
+                if not hex_chars.issuperset(raw_val):
+                    return None, f"bad_field:{name}"
+                value = format(int(raw_val, 16), 'b')
+            else:
+                # ASCII and HEX are passed through as text
+                value = raw_val
+
+            rows.append({
+                "Short name": name,
+                "Raw": segment,
+                "Value": value
+            })
+
+        return rows, None
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+QUARANTINE_MAXLEN = int(os.getenv("QUARANTINE_MAXLEN", "500"))
+
+# Only keep the start of a bad payload; garbage can be arbitrarily long.
+RAW_PREVIEW_CHARS = 512
+
+
+def reason_kind(reason: str) -> str:
+    """Group bad_field:<name> by its prefix so counters stay small."""
+    return reason.split(":", 1)[0]
+
+
+class Quarantine:
+    """
+    Bounded buffer of malformed packets plus per-device reject counters.
+
+    Malformed packets land here instead of in latest/history. This is the
+    in-process implementation behind InProcessStateStore; SQLiteStateStore
+    keeps the same data in tables shared by every backend process.
+    """
+
+    def __init__(self, maxlen: int = QUARANTINE_MAXLEN):
+        self._lock = threading.Lock()
+        self._packets: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+        self._counters: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, device_id: str, topic: str, raw: str, reason: str):
+        now = time.time()
+        with self._lock:
+            self._packets.append({
+                "device_id": device_id,
+                "topic": topic,
+                "reason": reason,
+                "raw": raw[:RAW_PREVIEW_CHARS],
+                "length": len(raw),
+                "received_at": now,
+            })
+            counters = self._counters.get(device_id)
+            if counters is None:
+                counters = self._counters[device_id] = {"total": 0, "reasons": {}, "last_at": None}
+            counters["total"] += 1
+            kind = reason_kind(reason)
+            counters["reasons"][kind] = counters["reasons"].get(kind, 0) + 1
+            counters["last_at"] = now
+
+    def recent(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return quarantined packets, newest first."""
+        with self._lock:
+            packets = list(self._packets)
+        if device_id is not None:
+            packets = [p for p in packets if p["device_id"] == device_id]
+        return list(reversed(packets[-limit:])) if limit > 0 else []
+
+    def counters(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                device_id: {**c, "reasons": dict(c["reasons"])}
+                for device_id, c in self._counters.items()
+            }
@@ -1,26 +1,64 @@
 import threading
-import time
-from typing import Any, Dict
-
-latest_data_lock = threading.Lock()
-latest_data: Dict[str, Any] = {
-    "raw": None,
-    "parsed": None,
-    "device_id": None,
-    "topic": None,
-    "last_updated": None,
-}
+from typing import Any, Dict, List, Optional
+
+from .state_store import StateStore, create_store_from_env
+
+_store_lock = threading.Lock()
+_store: Optional[StateStore] = None
+
+
+def get_store() -> StateStore:
+    """Return the process-wide state store, created from env on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store_from_env()
+    return _store
+
+
+def set_store(store: StateStore):
+    """Swap the state store (e.g. to share state across uvicorn workers)."""
+    global _store
+    with _store_lock:
+        if _store is not None and _store is not store:
+            _store.close()
+        _store = store
+
+
+def swap_store(store: Optional[StateStore]) -> Optional[StateStore]:
+    """Install `store` without closing the current one; return the current one."""
+    global _store
+    with _store_lock:
+        previous, _store = _store, store
+    return previous
+
 
 def update_latest(raw: str, parsed_rows, device_id: str, topic: str):
-    """Update the globally shared latest data."""
-    with latest_data_lock:
-        latest_data["raw"] = raw
-        latest_data["parsed"] = parsed_rows  # list[dict]
-        latest_data["device_id"] = device_id
-        latest_data["topic"] = topic
-        latest_data["last_updated"] = time.time()
-
-def get_latest_data() -> Dict[str, Any]:
+    """Update the shared latest data."""
+    get_store().update_latest(raw, parsed_rows, device_id, topic)
+
+
+def get_latest_data(device_id: Optional[str] = None) -> Dict[str, Any]:
     """Return a copy of the latest data so callers can't mutate it."""
-    with latest_data_lock:
-        return dict(latest_data)
+    return get_store().get_latest(device_id)
+
+
+def get_history(device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """Return parsed messages, newest first."""
+    return get_store().get_history(device_id, limit)
+
+
+def record_quarantine(device_id: str, topic: str, raw: str, reason: str):
+    """Record a malformed packet instead of updating latest/history."""
+    get_store().add_quarantined(device_id, topic, raw, reason)
+
+
+def get_quarantined(device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """Return quarantined packets, newest first."""
+    return get_store().get_quarantined(device_id, limit)
+
+
+def get_quarantine_counters() -> Dict[str, Dict[str, Any]]:
+    """Return per-device reject counters."""
+    return get_store().get_quarantine_counters()
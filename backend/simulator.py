@@ -0,0 +1,375 @@
+"""
+Synthetic device fleet and load generator for capacity planning.
+
+Builds valid hex datalog packets from a register dictionary (the JSON
+produced by `excel_to_json`), publishes them for N virtual devices through
+an in-process stand-in broker into the real ingest path, and reports the
+ingest rate, drop rate and end-to-end latency achieved.
+
+    python -m backend.simulator dictionary.json --devices 200 --rate 1 --duration 10
+    python -m backend.simulator dictionary.json --devices 200 --sweep
+"""
+
+import argparse
+import json
+import math
+import queue
+import random
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional
+
+from .parser_logic import CompiledDictionary, apply_checksum
+from .state_store import InProcessStateStore
+
+SIM_TOPIC_TEMPLATE = "/SIM/{device_id}/Datalog"
+
+
+# ---------------------------------------------------------------------------
+# Field dynamics
+# ---------------------------------------------------------------------------
+def _dynamic_fn(spec: Dict[str, Any], rng: random.Random) -> Callable[[float], float]:
+    """
+    Build f(t) -> engineering value from a dynamics spec:
+
+      {"kind": "constant", "value": 25}
+      {"kind": "random",   "min": 0, "max": 100}
+      {"kind": "ramp",     "min": 0, "max": 100, "period_s": 60}
+      {"kind": "sine",     "min": 20, "max": 30, "period_s": 300}
+    """
+    kind = spec.get("kind", "random")
+    lo = float(spec.get("min", 0.0))
+    hi = float(spec.get("max", 100.0))
+    period = float(spec.get("period_s", 60.0))
+
+    if kind == "constant":
+        value = float(spec.get("value", lo))
+        return lambda t: value
+    if kind == "random":
+        return lambda t: rng.uniform(lo, hi)
+    if kind == "ramp":
+        return lambda t: lo + (hi - lo) * ((t % period) / period)
+    if kind == "sine":
+        mid, amp = (lo + hi) / 2, (hi - lo) / 2
+        return lambda t: mid + amp * math.sin(2 * math.pi * t / period)
+    raise ValueError(f"Unknown dynamics kind: {kind}")
+
+
+class PacketGenerator:
+    """Encodes register values into a hex datalog packet for one dictionary."""
+
+    def __init__(
+        self,
+        registers: List[Dict[str, Any]],
+        dynamics: Optional[Dict[str, Dict[str, Any]]] = None,
+        checksum: Optional[Dict[str, Any]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.registers = registers
+        self.checksum = checksum
+        self.length = CompiledDictionary(registers, checksum).expected_length
+        rng = random.Random(seed)
+        dynamics = dynamics or {}
+
+        self._encoders = []
+        for reg in registers:
+            width = reg["total_upto"] - reg["index"]
+            spec = dynamics.get(reg["short_name"])
+            if spec is None:
+                spec = self._default_dynamics(reg, width)
+            self._encoders.append((reg["index"], width, reg, _dynamic_fn(spec, rng)))
+
+    @staticmethod
+    def _default_dynamics(reg: Dict[str, Any], width: int) -> Dict[str, Any]:
+        if reg["format"] == "DEC":
+            # Stay inside the raw range the field can carry
+            max_raw = (1 << (width * 4 - (1 if reg["signed"] else 0))) - 1
+            lo = reg["offset"]
+            hi = reg["offset"] + reg["scaling"] * min(max_raw, 1000)
+            return {"kind": "sine", "min": min(lo, hi), "max": max(lo, hi), "period_s": 300}
+        return {"kind": "random", "min": 0, "max": (1 << (width * 4)) - 1}
+
+    @staticmethod
+    def _encode(reg: Dict[str, Any], width: int, value: float) -> str:
+        fmt = reg["format"]
+        if fmt == "ASCII":
+            return f"{int(value):0{width}d}"[-width:]
+
+        bits = width * 4
+        if fmt == "DEC":
+            scaling = reg["scaling"] or 1.0
+            num = round((value - reg["offset"]) / scaling)
+            if reg["signed"]:
+                num = max(-(1 << (bits - 1)), min(num, (1 << (bits - 1)) - 1)) & ((1 << bits) - 1)
+            else:
+                num = max(0, min(num, (1 << bits) - 1))
+        else:
+            num = max(0, min(int(value), (1 << bits) - 1))
+        return f"{num:0{width}X}"
+
+    def packet(self, t: float) -> str:
+        buf = ["0"] * self.length
+        for idx, width, reg, fn in self._encoders:
+            buf[idx:idx + width] = self._encode(reg, width, fn(t))
+        packet = "".join(buf)
+
+        if self.checksum:
+            packet = apply_checksum(self.checksum, packet)
+        return packet
+
+
+# ---------------------------------------------------------------------------
+# Stand-in broker
+# ---------------------------------------------------------------------------
+class InProcessBroker:
+    """
+    Bounded queue with consumer threads calling `handler(topic, payload)`.
+
+    A full queue drops the message, like an overloaded broker or client
+    buffer would. Latency is measured from publish to handler return. A
+    handler exception is counted in `errors` and the consumer carries on,
+    as the MQTT worker's on_message does.
+    """
+
+    def __init__(self, handler: Callable[[str, str], Any], consumers: int = 1, maxsize: int = 10000):
+        self.handler = handler
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._consumers = consumers
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.errors = 0
+        self.latencies = array("d")
+
+    def publish(self, topic: str, payload: str):
+        self.published += 1
+        try:
+            self._queue.put_nowait((topic, payload, time.perf_counter()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            topic, payload, t_pub = item
+            try:
+                self.handler(topic, payload)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                continue
+            latency = time.perf_counter() - t_pub
+            with self._lock:
+                self.delivered += 1
+                self.latencies.append(latency)
+
+    def start(self):
+        for _ in range(self._consumers):
+            t = threading.Thread(target=self._consume, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def drain_and_stop(self, timeout: float = 30.0):
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+def _percentile(sorted_values, pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+# ---------------------------------------------------------------------------
+# Load run
+# ---------------------------------------------------------------------------
+def run_load(
+    registers: List[Dict[str, Any]],
+    devices: int = 100,
+    rate_hz: float = 1.0,
+    duration_s: float = 10.0,
+    dynamics: Optional[Dict[str, Dict[str, Any]]] = None,
+    checksum: Optional[Dict[str, Any]] = None,
+    consumers: int = 1,
+    queue_size: int = 10000,
+    frames: int = 64,
+    seed: Optional[int] = 0,
+    rules: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Publish `devices` x `rate_hz` packets/s for `duration_s` through the
+    backend ingest path and return throughput / drop / latency figures.
+
+    Packets are pre-generated (`frames` samples of the dynamics, 1/rate_hz
+    apart) so encoding cost does not compete with ingest for the GIL;
+    devices cycle through them with a per-device phase.
+
+    The run uses its own in-process store and an alert engine without a
+    webhook (evaluating `rules`, if given); the process-wide ones are put
+    back and the SIM routes removed afterwards.
+    """
+    from .alerts import AlertEngine, swap_engine
+    from .mqtt_worker import add_routes, ingest, register_dictionary, remove_routes
+    from .shared_state import swap_store
+
+    generator = PacketGenerator(registers, dynamics, checksum, seed)
+    dt = 1.0 / rate_hz if rate_hz > 0 else 1.0
+    packets = [generator.packet(i * dt) for i in range(frames)]
+
+    # Ingest into a private store and an engine without a webhook, so SIM
+    # devices never reach the shared database or the real alert webhook
+    store = InProcessStateStore()
+    engine = AlertEngine(store=store)
+    if rules:
+        engine.set_rules(rules)
+    previous_store, previous_engine = swap_store(store), swap_engine(engine)
+    device_ids = [f"SIM{i:06d}" for i in range(devices)]
+    topics = [SIM_TOPIC_TEMPLATE.format(device_id=d) for d in device_ids]
+    try:
+        dict_key = register_dictionary(registers, checksum=checksum)
+        engine.register_dictionary(dict_key, registers)
+        add_routes([(d, t, dict_key) for d, t in zip(device_ids, topics)])
+        return _drive(store, ingest, topics, packets, devices, rate_hz, duration_s,
+                      consumers, queue_size, frames)
+    finally:
+        remove_routes(device_ids)
+        swap_store(previous_store)
+        swap_engine(previous_engine)
+
+
+def _drive(store, ingest, topics, packets, devices, rate_hz, duration_s,
+           consumers, queue_size, frames) -> Dict[str, Any]:
+    """Publish the pre-generated packets at the offered rate and measure ingest."""
+    broker = InProcessBroker(ingest, consumers=consumers, maxsize=queue_size)
+    broker.start()
+
+    total_rate = devices * rate_hz
+    total = int(total_rate * duration_s)
+    sent = 0
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+
+    while sent < total:
+        due = min(total, int((time.perf_counter() - t0) * total_rate))
+        while sent < due:
+            dev = sent % devices
+            frame = (sent // devices + dev) % frames
+            broker.publish(topics[dev], packets[frame])
+            sent += 1
+        time.sleep(0.001)
+
+    publish_elapsed = time.perf_counter() - t0
+    broker.drain_and_stop()
+    elapsed = time.perf_counter() - t0
+    cpu_s = time.process_time() - cpu0
+
+    quarantined = sum(c["total"] for c in store.get_quarantine_counters().values())
+    latencies = sorted(broker.latencies)
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 3)
+
+    return {
+        "devices": devices,
+        "rate_hz_per_device": rate_hz,
+        "offered_msgs_per_s": round(total_rate, 1),
+        "published": broker.published,
+        "delivered": broker.delivered,
+        "dropped": broker.dropped,
+        "ingest_errors": broker.errors,
+        "quarantined": quarantined,
+        "drop_rate": round(broker.dropped / broker.published, 4) if broker.published else 0.0,
+        "publish_elapsed_s": round(publish_elapsed, 3),
+        "elapsed_s": round(elapsed, 3),
+        "ingest_msgs_per_s": round(broker.delivered / elapsed, 1) if elapsed else 0.0,
+        "cpu_s": round(cpu_s, 3),
+        "msgs_per_cpu_s": round(broker.delivered / cpu_s, 1) if cpu_s else None,
+        "latency_ms": {
+            "p50": ms(_percentile(latencies, 50)),
+            "p95": ms(_percentile(latencies, 95)),
+            "p99": ms(_percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def find_saturation(
+    registers: List[Dict[str, Any]],
+    devices: int = 100,
+    start_rate_hz: float = 1.0,
+    duration_s: float = 5.0,
+    max_drop_rate: float = 0.01,
+    max_steps: int = 12,
+    **kwargs,
+) -> Dict[str, Any]:
+    """
+    Double the per-device rate until messages are dropped or ingest falls
+    behind the offered load; return every step and the last sustainable one.
+    """
+    steps = []
+    sustained = None
+    rate = start_rate_hz
+    for _ in range(max_steps):
+        result = run_load(registers, devices=devices, rate_hz=rate, duration_s=duration_s, **kwargs)
+        steps.append(result)
+        keeping_up = result["ingest_msgs_per_s"] >= 0.95 * result["offered_msgs_per_s"]
+        if result["drop_rate"] > max_drop_rate or not keeping_up:
+            break
+        sustained = result
+        rate *= 2
+    return {"sustained": sustained, "steps": steps}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Synthetic device fleet load generator")
+    parser.add_argument("dictionary", help="register dictionary JSON (from excel_to_json)")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="packets/s per device")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--dynamics", help="JSON file: {short_name: dynamics spec}")
+    parser.add_argument("--checksum", help="JSON file with a checksum spec")
+    parser.add_argument("--rules", help="JSON file with alert rules to evaluate")
+    parser.add_argument("--consumers", type=int, default=1, help="ingest threads")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--sweep", action="store_true", help="double the rate until saturation")
+    args = parser.parse_args(argv)
+
+    def load(path):
+        if not path:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    registers = load(args.dictionary)
+    kwargs = {
+        "dynamics": load(args.dynamics),
+        "checksum": load(args.checksum),
+        "rules": load(args.rules),
+        "consumers": args.consumers,
+        "queue_size": args.queue_size,
+    }
+
+    if args.sweep:
+        result = find_saturation(
+            registers, devices=args.devices, start_rate_hz=args.rate,
+            duration_s=args.duration, **kwargs,
+        )
+    else:
+        result = run_load(
+            registers, devices=args.devices, rate_hz=args.rate,
+            duration_s=args.duration, **kwargs,
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .quarantine import QUARANTINE_MAXLEN, RAW_PREVIEW_CHARS, Quarantine, reason_kind
+
+HISTORY_MAXLEN = 2000
+ALERTS_MAXLEN = 1000
+
+
+def _empty_latest() -> Dict[str, Any]:
+    return {
+        "raw": None,
+        "parsed": None,
+        "device_id": None,
+        "topic": None,
+        "last_updated": None,
+    }
+
+
+class StateStore(ABC):
+    """
+    Interface for the latest-packet / history store.
+
+    Implementations must be safe to call from the MQTT worker threads and
+    the API request handlers at the same time.
+    """
+
+    @abstractmethod
+    def update_latest(self, raw: str, parsed_rows, device_id: str, topic: str):
+        ...
+
+    @abstractmethod
+    def get_latest(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def get_history(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return history entries, newest first; an empty list if limit <= 0."""
+
+    @abstractmethod
+    def last_seen(self) -> Dict[str, float]:
+        """Return {device_id: last_updated} for every device with data."""
+
+    @abstractmethod
+    def add_alert(self, alert: Dict[str, Any], dedup_key: str) -> bool:
+        """
+        Record a fired alert. Returns False if an alert with the same
+        dedup_key was already recorded (e.g. by another process).
+        """
+
+    @abstractmethod
+    def get_alerts(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return fired alerts, newest first."""
+
+    @abstractmethod
+    def add_quarantined(self, device_id: str, topic: str, raw: str, reason: str):
+        """Record a malformed packet and count it against its device."""
+
+    @abstractmethod
+    def get_quarantined(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return quarantined packets, newest first."""
+
+    @abstractmethod
+    def get_quarantine_counters(self) -> Dict[str, Dict[str, Any]]:
+        """Return {device_id: {"total", "reasons", "last_at"}}."""
+
+    def close(self):
+        pass
+
+
+class InProcessStateStore(StateStore):
+    """Plain dict + deque store. Only visible inside the current process."""
+
+    def __init__(self, history_maxlen: int = HISTORY_MAXLEN):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Any] = _empty_latest()
+        self._latest_by_device: Dict[str, Dict[str, Any]] = {}
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history_maxlen)
+        self._alerts: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        self._alert_keys: Set[str] = set()
+        self._quarantine = Quarantine()
+
+    def update_latest(self, raw: str, parsed_rows, device_id: str, topic: str):
+        entry = {
+            "raw": raw,
+            "parsed": parsed_rows,  # list[dict]
+            "device_id": device_id,
+            "topic": topic,
+            "last_updated": time.time(),
+        }
+        with self._lock:
+            self._latest = entry
+            self._latest_by_device[device_id] = entry
+            self._history.append(entry)
+
+    def get_latest(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            if device_id is None:
+                return dict(self._latest)
+            return dict(self._latest_by_device.get(device_id) or _empty_latest())
+
+    def get_history(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._history)
+        if device_id is not None:
+            entries = [e for e in entries if e["device_id"] == device_id]
+        # newest first, same as the Streamlit history table
+        return [dict(e) for e in reversed(entries[-limit:])] if limit > 0 else []
+
+    def last_seen(self) -> Dict[str, float]:
+        with self._lock:
+            return {d: e["last_updated"] for d, e in self._latest_by_device.items()}
+
+    def add_alert(self, alert: Dict[str, Any], dedup_key: str) -> bool:
+        with self._lock:
+            if dedup_key in self._alert_keys:
+                return False
+            if len(self._alerts) >= ALERTS_MAXLEN:
+                old_key, _ = self._alerts.popleft()
+                self._alert_keys.discard(old_key)
+            self._alerts.append((dedup_key, dict(alert)))
+            self._alert_keys.add(dedup_key)
+        return True
+
+    def get_alerts(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            alerts = [a for _, a in self._alerts]
+        return [dict(a) for a in reversed(alerts[-limit:])] if limit > 0 else []
+
+    def add_quarantined(self, device_id: str, topic: str, raw: str, reason: str):
+        self._quarantine.record(device_id, topic, raw, reason)
+
+    def get_quarantined(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        return self._quarantine.recent(device_id, limit)
+
+    def get_quarantine_counters(self) -> Dict[str, Dict[str, Any]]:
+        return self._quarantine.counters()
+
+
+class SQLiteStateStore(StateStore):
+    """
+    SQLite store in WAL mode, shared by every backend process on the host.
+
+    Each thread gets its own connection; WAL lets the API workers read
+    while an ingest process is writing.
+    """
+
+    def __init__(self, path: str, history_maxlen: int = HISTORY_MAXLEN):
+        self.path = path
+        self.history_maxlen = history_maxlen
+        self._local = threading.local()
+        self._conns_lock = threading.Lock()
+        self._conns: List[sqlite3.Connection] = []
+        self._writes = 0
+        self._alert_writes = 0
+        self._quarantine_writes = 0
+
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS latest (
+                device_id TEXT PRIMARY KEY,
+                raw TEXT,
+                parsed TEXT,
+                topic TEXT,
+                last_updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT,
+                raw TEXT,
+                parsed TEXT,
+                topic TEXT,
+                last_updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS history_device ON history (device_id, id);
+            CREATE INDEX IF NOT EXISTS latest_updated ON latest (last_updated);
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedup_key TEXT UNIQUE,
+                alert TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS quarantine (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT,
+                topic TEXT,
+                reason TEXT,
+                raw TEXT,
+                length INTEGER,
+                received_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS quarantine_device ON quarantine (device_id, id);
+            CREATE TABLE IF NOT EXISTS quarantine_counters (
+                device_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                last_at REAL,
+                PRIMARY KEY (device_id, kind)
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only used by this thread, but close() may run on another one
+            conn = sqlite3.connect(
+                self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    @staticmethod
+    def _row_to_entry(row) -> Dict[str, Any]:
+        device_id, raw, parsed, topic, last_updated = row
+        return {
+            "raw": raw,
+            "parsed": json.loads(parsed) if parsed is not None else None,
+            "device_id": device_id,
+            "topic": topic,
+            "last_updated": last_updated,
+        }
+
+    def update_latest(self, raw: str, parsed_rows, device_id: str, topic: str):
+        row = (device_id, raw, json.dumps(parsed_rows), topic, time.time())
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO latest (device_id, raw, parsed, topic, last_updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                row,
+            )
+            cur = conn.execute(
+                "INSERT INTO history (device_id, raw, parsed, topic, last_updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                row,
+            )
+            # Trim in batches rather than on every insert
+            self._writes += 1
+            if self._writes % 100 == 0:
+                conn.execute(
+                    "DELETE FROM history WHERE id <= ?",
+                    (cur.lastrowid - self.history_maxlen,),
+                )
+
+    def get_latest(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        cols = "device_id, raw, parsed, topic, last_updated"
+        if device_id is None:
+            row = self._conn().execute(
+                f"SELECT {cols} FROM latest ORDER BY last_updated DESC LIMIT 1"
+            ).fetchone()
+        else:
+            row = self._conn().execute(
+                f"SELECT {cols} FROM latest WHERE device_id = ?", (device_id,)
+            ).fetchone()
+        return self._row_to_entry(row) if row else _empty_latest()
+
+    def get_history(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []  # SQLite treats a negative LIMIT as "no limit"
+        cols = "device_id, raw, parsed, topic, last_updated"
+        if device_id is None:
+            rows = self._conn().execute(
+                f"SELECT {cols} FROM history ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                f"SELECT {cols} FROM history WHERE device_id = ? ORDER BY id DESC LIMIT ?",
+                (device_id, limit),
+            ).fetchall()
+        return [self._row_to_entry(r) for r in rows]
+
+    def last_seen(self) -> Dict[str, float]:
+        rows = self._conn().execute("SELECT device_id, last_updated FROM latest").fetchall()
+        return dict(rows)
+
+    def add_alert(self, alert: Dict[str, Any], dedup_key: str) -> bool:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO alerts (dedup_key, alert) VALUES (?, ?)",
+                (dedup_key, json.dumps(alert)),
+            )
+            if cur.rowcount == 0:
+                return False
+            self._alert_writes += 1
+            if self._alert_writes % 100 == 0:
+                conn.execute(
+                    "DELETE FROM alerts WHERE id <= ?",
+                    (cur.lastrowid - ALERTS_MAXLEN,),
+                )
+        return True
+
+    def get_alerts(self, limit: int = 100) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        rows = self._conn().execute(
+            "SELECT alert FROM alerts ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def add_quarantined(self, device_id: str, topic: str, raw: str, reason: str):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "INSERT INTO quarantine (device_id, topic, reason, raw, length, received_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (device_id, topic, reason, raw[:RAW_PREVIEW_CHARS], len(raw), now),
+            )
+            conn.execute(
+                "INSERT INTO quarantine_counters (device_id, kind, count, last_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (device_id, kind) DO UPDATE SET count = count + 1, last_at = excluded.last_at",
+                (device_id, reason_kind(reason), now),
+            )
+            self._quarantine_writes += 1
+            if self._quarantine_writes % 100 == 0:
+                conn.execute(
+                    "DELETE FROM quarantine WHERE id <= ?",
+                    (cur.lastrowid - QUARANTINE_MAXLEN,),
+                )
+
+    def get_quarantined(self, device_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        cols = "device_id, topic, reason, raw, length, received_at"
+        if device_id is None:
+            rows = self._conn().execute(
+                f"SELECT {cols} FROM quarantine ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                f"SELECT {cols} FROM quarantine WHERE device_id = ? ORDER BY id DESC LIMIT ?",
+                (device_id, limit),
+            ).fetchall()
+        keys = ("device_id", "topic", "reason", "raw", "length", "received_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_quarantine_counters(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT device_id, kind, count, last_at FROM quarantine_counters"
+        ).fetchall()
+        counters: Dict[str, Dict[str, Any]] = {}
+        for device_id, kind, count, last_at in rows:
+            c = counters.setdefault(device_id, {"total": 0, "reasons": {}, "last_at": None})
+            c["total"] += count
+            c["reasons"][kind] = count
+            if c["last_at"] is None or last_at > c["last_at"]:
+                c["last_at"] = last_at
+        return counters
+
+    def close(self):
+        """Close every thread's connection, not just the caller's."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+
+def create_store_from_env() -> StateStore:
+    """
+    STATE_STORE=memory (default) keeps everything in this process.
+    STATE_STORE=sqlite shares state across processes via STATE_DB_PATH.
+    """
+    kind = os.getenv("STATE_STORE", "memory").strip().lower()
+    if kind == "memory":
+        return InProcessStateStore()
+    if kind == "sqlite":
+        return SQLiteStateStore(os.getenv("STATE_DB_PATH", "parser_state.db"))
+    raise ValueError(f"Unknown STATE_STORE: {kind}")
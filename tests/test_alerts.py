@@ -0,0 +1,140 @@
+import pytest
+
+from backend.alerts import AlertEngine, validate_rules
+from backend.state_store import InProcessStateStore, SQLiteStateStore
+
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": False, "scaling": 1, "offset": 0},
+    {"short_name": "FLAGS", "index": 4, "total_upto": 6, "format": "BIN",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+
+
+def make_engine(rules, store=None):
+    engine = AlertEngine(store=store or InProcessStateStore())
+    engine.register_dictionary("ac", REGISTERS)
+    engine.set_rules(rules)
+    return engine
+
+
+def packet(temp=20, flags="0"):
+    return [{"Short name": "TEMP", "Value": temp}, {"Short name": "FLAGS", "Value": flags}]
+
+
+def fired(engine, rule_id=None):
+    return [a for a in reversed(engine.recent_alerts(1000))
+            if rule_id is None or a["rule_id"] == rule_id]
+
+
+HOT = {"rule_id": "hot", "type": "threshold", "field": "temp", "op": ">", "value": 50}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InProcessStateStore()
+    return SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+def test_threshold_fires_once_per_episode(store):
+    engine = make_engine([HOT], store)
+    for now, temp in [(120, 60), (125, 70), (130, 40), (140, 60)]:
+        engine.evaluate("ac", "D1", packet(temp), now=now)
+    alerts = fired(engine)
+    # OK -> firing at 120, stays firing at 125, clears at 130, fires again at 140
+    assert [(a["fired_at"], a["value"]) for a in alerts] == [(120, 60), (140, 60)]
+    assert alerts[0]["device_id"] == "D1" and alerts[0]["severity"] == "warning"
+
+
+def test_threshold_ignores_non_numeric_values():
+    engine = make_engine([{**HOT, "field": "FLAGS", "op": "!=", "value": 0}])
+    engine.evaluate("ac", "D1", packet(flags="101"), now=1)
+    assert fired(engine) == []
+
+
+def test_rate_of_change():
+    engine = make_engine([{"rule_id": "jump", "type": "rate_of_change", "field": "TEMP",
+                           "max_per_s": 2}])
+    engine.evaluate("ac", "D1", packet(20), now=100)   # first sample: no rate yet
+    engine.evaluate("ac", "D1", packet(30), now=110)   # 1/s
+    engine.evaluate("ac", "D1", packet(60), now=115)   # 6/s
+    engine.evaluate("ac", "D2", packet(90), now=116)   # other device: first sample
+    engine.evaluate("ac", "D1", packet(60), now=115)   # no time passed: ignored
+    alerts = fired(engine)
+    assert [(a["device_id"], a["value"]) for a in alerts] == [("D1", pytest.approx(6.0))]
+
+
+@pytest.mark.parametrize("rule, flags, firing", [
+    ({"mask": 0b100}, "100", True),
+    ({"mask": 0b100}, "011", False),
+    ({"mask": 0b110, "equals": 0b010}, "011", True),
+    ({"mask": 0b110, "equals": 0b010}, "111", False),
+    ({"mask": 0b1}, "", False),
+])
+def test_bitfield(rule, flags, firing):
+    engine = make_engine([{"rule_id": "fault", "type": "bitfield", "field": "FLAGS", **rule}])
+    engine.evaluate("ac", "D1", packet(flags=flags), now=1)
+    assert bool(fired(engine)) is firing
+
+
+def test_device_scoped_and_fleet_rules():
+    engine = make_engine([
+        HOT,
+        {**HOT, "rule_id": "d2-warm", "value": 30, "device_id": "D2"},
+    ])
+    engine.evaluate("ac", "D1", packet(40), now=1)
+    engine.evaluate("ac", "D2", packet(40), now=1)
+    engine.evaluate("ac", "D3", packet(60), now=1)
+    assert [(a["rule_id"], a["device_id"]) for a in fired(engine)] == [
+        ("d2-warm", "D2"),
+        ("hot", "D3"),
+    ]
+
+
+def test_rules_for_unknown_fields_are_skipped():
+    engine = make_engine([{**HOT, "field": "HUMIDITY"}])
+    engine.evaluate("ac", "D1", packet(99), now=1)
+    assert fired(engine) == []
+
+
+def test_stale_fires_once_per_silence(store):
+    engine = make_engine([
+        {"rule_id": "silent", "type": "stale", "max_age_s": 60},
+        {"rule_id": "d2-silent", "type": "stale", "max_age_s": 10, "device_id": "D2"},
+    ], store)
+    store.update_latest("00", packet(), "D1", "/t/D1")
+    store.update_latest("00", packet(), "D2", "/t/D2")
+    seen = store.last_seen()["D1"]
+
+    engine.check_stale(now=seen + 30)
+    assert [(a["rule_id"], a["device_id"]) for a in fired(engine)] == [("d2-silent", "D2")]
+    engine.check_stale(now=seen + 90)
+    engine.check_stale(now=seen + 120)
+    assert sorted((a["rule_id"], a["device_id"]) for a in fired(engine)) == [
+        ("d2-silent", "D2"), ("silent", "D1"), ("silent", "D2"),
+    ]
+
+    # A new packet starts a new episode
+    store.update_latest("00", packet(), "D1", "/t/D1")
+    engine.check_stale(now=store.last_seen()["D1"] + 90)
+    assert len(fired(engine, "silent")) == 3
+
+
+def test_stale_sweep_in_another_process_does_not_repeat(tmp_path):
+    path = str(tmp_path / "state.db")
+    rules = [{"rule_id": "silent", "type": "stale", "max_age_s": 1}]
+    first = make_engine(rules, SQLiteStateStore(path))
+    second = make_engine(rules, SQLiteStateStore(path))
+    first.store.update_latest("00", packet(), "D1", "/t/D1")
+    now = first.store.last_seen()["D1"] + 5
+    first.check_stale(now=now)
+    second.check_stale(now=now)
+    assert len(fired(first)) == 1
+
+
+def test_set_rules_validates():
+    with pytest.raises(Exception):
+        validate_rules([{"rule_id": "x", "type": "threshold", "field": "TEMP"}])
+    with pytest.raises(ValueError, match="Duplicate"):
+        validate_rules([HOT, HOT])
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import api, config_store
+from backend.config_store import DeviceRegistry
+from backend.shared_state import set_store
+from backend.state_store import InProcessStateStore
+
+# Nothing listens on port 1, so broker connections never come up
+BROKER = {"broker": "127.0.0.1", "port": 1}
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = DeviceRegistry(str(tmp_path / "registry.db"))
+    monkeypatch.setattr(config_store, "_registry", registry)
+    set_store(InProcessStateStore())
+    yield registry
+    registry.close()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_ready_without_devices(registry):
+    app = api.create_app()
+    with TestClient(app) as client:
+        assert wait_for(lambda: app.state.startup["ready"])
+        assert client.get("/ready").status_code == 200
+        health = client.get("/health").json()
+        assert health["ready_after_s"] is not None
+        assert health["configured"] is False
+
+
+def test_unreachable_broker_times_out_to_ready(registry, monkeypatch):
+    monkeypatch.setattr(api, "READY_TIMEOUT_S", 0.3)
+    registry.save(
+        {"h": {"registers": REGISTERS, "checksum": None}},
+        [{"device_id": "AC1", "topic": "/t/AC1", "dict_hash": "h", **BROKER}],
+    )
+    app = api.create_app()
+    with TestClient(app) as client:
+        assert client.get("/ready").status_code == 503
+        assert wait_for(lambda: app.state.startup["ready"])
+        health = client.get("/health").json()
+        assert health["devices_loaded"] == 1
+        assert health["ready_after_s"] is None
+        assert health["brokers"] == {"127.0.0.1:1": False}
+
+
+def test_shutdown_does_not_mark_ready(registry):
+    registry.save(
+        {"h": {"registers": REGISTERS, "checksum": None}},
+        [{"device_id": "AC1", "topic": "/t/AC1", "dict_hash": "h", **BROKER}],
+    )
+    app = api.create_app()
+    with TestClient(app):
+        assert wait_for(lambda: app.state.startup["devices_loaded"] == 1)
+    time.sleep(0.2)
+    assert app.state.startup["ready"] is False
+
+
+def test_configure_bulk(registry):
+    app = api.create_app()
+    with TestClient(app) as client:
+        response = client.post("/configure/bulk", json={
+            "dictionaries": {"ac": REGISTERS},
+            "devices": [
+                {"device_id": "AC1", "dictionary": "ac", **BROKER},
+                {"device_id": "AC2", "dictionary": "ac", "topic": "/t/AC2", **BROKER},
+            ],
+        })
+        assert response.status_code == 200
+        dict_key = response.json()["dictionaries"]["ac"]
+        assert {d["device_id"]: d["topic"] for d in client.get("/devices").json()} == {
+            "AC1": api.DEFAULT_TOPIC_TEMPLATE.format(device_id="AC1"),
+            "AC2": "/t/AC2",
+        }
+
+        # By hash, but taking AC1's topic: rejected, nothing saved
+        response = client.post("/configure/bulk", json={"devices": [
+            {"device_id": "AC3", "dictionary_hash": dict_key, "topic": "/t/AC2", **BROKER},
+        ]})
+        assert response.status_code == 400
+        assert "already used by AC2" in response.json()["detail"]["errors"][0]
+
+        response = client.post("/configure/bulk", json={"devices": [
+            {"device_id": "AC3", "dictionary_hash": "unknown", **BROKER},
+        ]})
+        assert response.status_code == 400
+        assert len(client.get("/devices").json()) == 2
+
+        # Swapping topics within one batch is allowed
+        response = client.post("/configure/bulk", json={"devices": [
+            {"device_id": "AC1", "dictionary_hash": dict_key, "topic": "/t/AC2", **BROKER},
+            {"device_id": "AC2", "dictionary_hash": dict_key, "topic": "/t/AC1", **BROKER},
+        ]})
+        assert response.status_code == 200
+        assert {d["device_id"]: d["topic"] for d in client.get("/devices").json()} == {
+            "AC1": "/t/AC2",
+            "AC2": "/t/AC1",
+        }
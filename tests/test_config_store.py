@@ -0,0 +1,68 @@
+import pytest
+
+from backend.config_store import DeviceRegistry
+from backend.parser_logic import dictionary_hash
+
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+CHECKSUM = {"type": "sum8", "index": 4, "total_upto": 6}
+
+
+def test_registry_round_trip(tmp_path):
+    path = str(tmp_path / "registry.db")
+    dict_key = dictionary_hash(REGISTERS, CHECKSUM)
+    devices = [
+        {"device_id": "AC1", "topic": "/AC/1/AC1/Datalog", "broker": "localhost", "port": 1883,
+         "dict_hash": dict_key},
+        {"device_id": "AC2", "topic": "/AC/1/AC2/Datalog", "broker": "localhost", "port": 1883,
+         "dict_hash": dict_key},
+    ]
+    registry = DeviceRegistry(path)
+    registry.save({dict_key: {"registers": REGISTERS, "checksum": CHECKSUM}}, devices)
+    registry.save_rules([{"rule_id": "hot", "type": "threshold", "field": "TEMP", "op": ">", "value": 50}])
+    registry.close()
+
+    # A fresh connection sees exactly what was saved
+    registry = DeviceRegistry(path)
+    dictionaries, loaded = registry.load()
+    assert dictionaries == {dict_key: {"registers": REGISTERS, "checksum": CHECKSUM}}
+    assert sorted(loaded, key=lambda d: d["device_id"]) == devices
+    assert registry.get_dictionary(dict_key) == {"registers": REGISTERS, "checksum": CHECKSUM}
+    assert registry.get_dictionary("missing") is None
+    assert registry.topic_owners(["/AC/1/AC2/Datalog", "/other"]) == {"/AC/1/AC2/Datalog": "AC2"}
+    assert registry.load_rules()[0]["rule_id"] == "hot"
+    registry.close()
+
+
+def test_data_version_tracks_other_connections(tmp_path):
+    path = str(tmp_path / "registry.db")
+    reader, writer = DeviceRegistry(path), DeviceRegistry(path)
+    before = reader.data_version()
+    writer.save_rules([])
+    assert reader.data_version() != before
+    reader.close()
+    writer.close()
+
+
+def _device(device_id, topic, dict_key):
+    return {"device_id": device_id, "topic": topic, "broker": "localhost", "port": 1883,
+            "dict_hash": dict_key}
+
+
+def test_topic_belongs_to_one_device(tmp_path):
+    dict_key = dictionary_hash(REGISTERS)
+    dictionaries = {dict_key: {"registers": REGISTERS, "checksum": None}}
+    registry = DeviceRegistry(str(tmp_path / "registry.db"))
+    registry.save(dictionaries, [_device("AC1", "/t/1", dict_key), _device("AC2", "/t/2", dict_key)])
+
+    with pytest.raises(ValueError, match="already used by AC1"):
+        registry.save({}, [_device("AC3", "/t/1", dict_key)])
+    with pytest.raises(ValueError):
+        registry.save({}, [_device("AC3", "/t/3", dict_key), _device("AC4", "/t/3", dict_key)])
+
+    # Devices of one batch may swap topics
+    registry.save({}, [_device("AC1", "/t/2", dict_key), _device("AC2", "/t/1", dict_key)])
+    assert registry.topic_owners(["/t/1", "/t/2", "/t/3"]) == {"/t/1": "AC2", "/t/2": "AC1"}
+    registry.close()
@@ -0,0 +1,36 @@
+from backend.mqtt_worker import add_route, ingest, register_dictionary
+from backend.shared_state import get_latest_data, get_quarantine_counters, get_quarantined
+
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+CHECKSUM = {"type": "xor8", "index": 4, "total_upto": 6}
+
+
+def setup_module():
+    dict_key = register_dictionary(REGISTERS, checksum=CHECKSUM)
+    add_route("TEST-INGEST", "/test/ingest", dict_key)
+    add_route("TEST-WILDCARD", "/test/+/wild", dict_key)
+
+
+def test_valid_packet_updates_latest():
+    rows = ingest("/test/ingest", "0102" + "03")
+    assert rows == [{"Short name": "TEMP", "Raw": "0102", "Value": 258}]
+    assert get_latest_data("TEST-INGEST")["raw"] == "010203"
+
+
+def test_wildcard_route():
+    assert ingest("/test/dev/wild", "010203") is not None
+    assert get_latest_data("TEST-WILDCARD")["topic"] == "/test/dev/wild"
+
+
+def test_bad_packets_are_quarantined():
+    assert ingest("/test/ingest", "0102") is None
+    assert ingest("/test/ingest", "0102FF") is None
+    assert ingest("/test/ingest", "0G0203") is None
+
+    counters = get_quarantine_counters()["TEST-INGEST"]
+    assert counters["total"] == 3
+    assert counters["reasons"] == {"short_packet": 1, "bad_checksum": 2}
+    assert get_quarantined("TEST-INGEST", 1)[0]["raw"] == "0G0203"
@@ -0,0 +1,56 @@
+from backend.mqtt_worker import BrokerWorker, topic_matches
+
+
+class FakeClient:
+    """Records SUBSCRIBE/UNSUBSCRIBE calls in the order they were sent."""
+
+    def __init__(self):
+        self.calls = []
+        self._mid = 0
+
+    def subscribe(self, topics):
+        self._mid += 1
+        self.calls.append(("sub", sorted(t for t, _ in topics)))
+        return 0, self._mid
+
+    def unsubscribe(self, topic):
+        self.calls.append(("unsub", topic))
+
+
+def test_remove_then_add_before_flush_keeps_the_topic():
+    worker, client = BrokerWorker("localhost", 1883), FakeClient()
+    worker.add_topic("/t/1")
+    worker._flush_subscriptions(client)
+    worker.remove_topic("/t/1")
+    worker.add_topic("/t/1")
+    worker._flush_subscriptions(client)
+    assert client.calls == [("sub", ["/t/1"])]
+
+
+def test_add_then_remove_before_flush_sends_nothing():
+    worker, client = BrokerWorker("localhost", 1883), FakeClient()
+    worker.add_topic("/t/1")
+    worker.remove_topic("/t/1")
+    worker._flush_subscriptions(client)
+    assert client.calls == []
+    assert worker.subscribed.is_set()
+
+
+def test_unsubscribes_are_sent_before_subscribes():
+    worker, client = BrokerWorker("localhost", 1883), FakeClient()
+    worker.add_topic("/t/1")
+    worker._flush_subscriptions(client)
+    worker.remove_topic("/t/1")
+    worker.add_topic("/t/2")
+    worker._flush_subscriptions(client)
+    assert client.calls == [("sub", ["/t/1"]), ("unsub", "/t/1"), ("sub", ["/t/2"])]
+    # Not subscribed until the broker acknowledges
+    assert not worker.subscribed.is_set()
+
+
+def test_topic_matches():
+    assert topic_matches("/AC/1/+/Datalog", "/AC/1/DEV/Datalog")
+    assert not topic_matches("/AC/1/+/Datalog", "/AC/1/DEV/Other")
+    assert topic_matches("#", "/AC/1/DEV/Datalog")
+    assert topic_matches("/AC/#", "/AC/1/DEV")
+    assert not topic_matches("/AC/1", "/AC/1/DEV")
@@ -0,0 +1,69 @@
+import pytest
+
+from backend.parser_logic import (
+    CompiledDictionary,
+    apply_checksum,
+    compute_checksum,
+    validate_checksum,
+)
+
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": True, "scaling": 0.1, "offset": 0},
+    {"short_name": "FLAGS", "index": 4, "total_upto": 6, "format": "BIN",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+
+
+# Known-answer vectors
+@pytest.mark.parametrize("checksum_type, data, expected", [
+    ("crc16_modbus", b"123456789", 0x4B37),
+    ("crc16_modbus", bytes.fromhex("01030000000A"), 0xCDC5),
+    ("sum8", b"123456789", 0xDD),
+    ("xor8", b"123456789", 0x31),
+    ("sum8", b"", 0x00),
+])
+def test_checksum_vectors(checksum_type, data, expected):
+    assert compute_checksum(checksum_type, data) == expected
+
+
+def test_apply_checksum_modbus_frame_is_little_endian_on_the_wire():
+    cs = {"type": "crc16_modbus", "index": 12, "total_upto": 16, "byteorder": "little"}
+    assert apply_checksum(cs, "01030000000A0000") == "01030000000AC5CD"
+
+
+def test_parse_valid_packet():
+    rows, reason = CompiledDictionary(REGISTERS).parse("FF9C05\n")
+    assert reason is None
+    assert rows[0] == {"Short name": "TEMP", "Raw": "FF9C", "Value": pytest.approx(-10.0)}
+    assert rows[1]["Value"] == "101"
+
+
+def test_short_packet():
+    assert CompiledDictionary(REGISTERS).parse("FF9C") == (None, "short_packet")
+
+
+def test_bad_field():
+    assert CompiledDictionary(REGISTERS).parse("FZ9C05") == (None, "bad_field:TEMP")
+
+
+def test_checksum_match_and_mismatch():
+    cs = {"type": "sum8", "index": 6, "total_upto": 8}
+    compiled = CompiledDictionary(REGISTERS, cs)
+    packet = apply_checksum(cs, "FF9C0500")
+    assert packet == "FF9C05A0"
+    assert compiled.parse(packet)[1] is None
+    assert compiled.parse("FF9C05A1") == (None, "bad_checksum")
+    assert compiled.parse("FF9C05ZZ") == (None, "bad_checksum")
+
+
+@pytest.mark.parametrize("checksum", [
+    {"type": "sum8", "index": 4, "total_upto": 7},
+    {"type": "crc16_modbus", "index": 4, "total_upto": 6},
+    {"type": "xor8", "index": 4, "total_upto": 6, "data_from": 1},
+])
+def test_checksum_layout_rejected(checksum):
+    with pytest.raises(Exception):
+        validate_checksum(checksum)
+    with pytest.raises(ValueError):
+        CompiledDictionary(REGISTERS, checksum)
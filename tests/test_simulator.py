@@ -0,0 +1,66 @@
+import pytest
+
+from backend import alerts, mqtt_worker
+from backend.parser_logic import CompiledDictionary
+from backend.shared_state import get_store
+from backend.simulator import InProcessBroker, PacketGenerator, run_load
+
+REGISTERS = [
+    {"short_name": "TEMP", "index": 0, "total_upto": 4, "format": "DEC",
+     "signed": True, "scaling": 0.1, "offset": 0},
+    {"short_name": "FLAGS", "index": 4, "total_upto": 6, "format": "BIN",
+     "signed": False, "scaling": 1, "offset": 0},
+    {"short_name": "MODE", "index": 6, "total_upto": 8, "format": "HEX",
+     "signed": False, "scaling": 1, "offset": 0},
+]
+DYNAMICS = {"TEMP": {"kind": "sine", "min": -20, "max": 40, "period_s": 10}}
+
+
+@pytest.mark.parametrize("checksum", [
+    None,
+    {"type": "sum8", "index": 8, "total_upto": 10},
+    {"type": "crc16_modbus", "index": 8, "total_upto": 12, "byteorder": "little"},
+])
+def test_generated_packets_parse(checksum):
+    generator = PacketGenerator(REGISTERS, DYNAMICS, checksum, seed=1)
+    compiled = CompiledDictionary(REGISTERS, checksum)
+    for i in range(20):
+        rows, reason = compiled.parse(generator.packet(i * 0.5))
+        assert reason is None
+        assert -20.1 <= rows[0]["Value"] <= 40.1
+
+
+def test_consumer_survives_handler_errors():
+    calls = []
+
+    def handler(topic, payload):
+        calls.append(payload)
+        if len(calls) % 2:
+            raise RuntimeError("boom")
+
+    broker = InProcessBroker(handler)
+    broker.start()
+    for i in range(10):
+        broker.publish("/t", str(i))
+    broker.drain_and_stop(timeout=2)
+    assert (broker.delivered, broker.errors) == (5, 5)
+
+
+def test_run_load_is_isolated():
+    store = get_store()
+    engine = alerts._engine
+    history_before = store.get_history(limit=1)
+
+    result = run_load(
+        REGISTERS, devices=3, rate_hz=20, duration_s=0.2, dynamics=DYNAMICS,
+        rules=[{"rule_id": "hot", "type": "threshold", "field": "TEMP", "op": ">", "value": 0}],
+    )
+    assert result["delivered"] == result["published"] > 0
+    assert result["quarantined"] == result["ingest_errors"] == 0
+
+    # Nothing reached the process-wide store, engine or routing tables
+    assert get_store() is store
+    assert alerts._engine is engine
+    assert store.get_history(limit=1) == history_before
+    assert not any(d.startswith("SIM") for d in store.last_seen())
+    assert mqtt_worker._match_route("/SIM/SIM000000/Datalog") is None
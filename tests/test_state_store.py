@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from backend.state_store import InProcessStateStore, SQLiteStateStore, StateStore
+
+ROWS = [{"Short name": "TEMP", "Raw": "0102", "Value": 258}]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = InProcessStateStore(history_maxlen=50)
+    else:
+        store = SQLiteStateStore(str(tmp_path / "state.db"), history_maxlen=50)
+    yield store
+    store.close()
+
+
+def test_state_store_is_abstract():
+    with pytest.raises(TypeError):
+        StateStore()
+
+
+def test_latest_round_trip(store):
+    assert store.get_latest("D1")["raw"] is None
+    store.update_latest("0102", ROWS, "D1", "/t/D1")
+    latest = store.get_latest("D1")
+    assert latest["raw"] == "0102"
+    assert latest["parsed"] == ROWS
+    assert latest["topic"] == "/t/D1"
+    assert set(store.last_seen()) == {"D1"}
+
+
+def test_latest_without_device_is_the_newest_packet(store):
+    store.update_latest("01", ROWS, "D1", "/t/D1")
+    time.sleep(0.01)
+    store.update_latest("02", ROWS, "D2", "/t/D2")
+    assert store.get_latest()["device_id"] == "D2"
+    time.sleep(0.01)
+    store.update_latest("03", ROWS, "D1", "/t/D1")
+    assert store.get_latest()["raw"] == "03"
+
+
+def test_history_order_filter_and_limit(store):
+    for i in range(5):
+        store.update_latest(f"{i:02X}", ROWS, f"D{i % 2}", "/t")
+    assert [e["raw"] for e in store.get_history(limit=3)] == ["04", "03", "02"]
+    assert [e["raw"] for e in store.get_history("D1")] == ["03", "01"]
+    assert store.get_history(limit=0) == []
+    assert store.get_history(limit=-1) == []
+
+
+def test_history_is_trimmed(store):
+    for i in range(200):
+        store.update_latest(f"{i:04X}", ROWS, "D1", "/t")
+    history = store.get_history(limit=1000)
+    assert len(history) == 50
+    assert history[0]["raw"] == f"{199:04X}"
+
+
+def test_sqlite_state_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer, reader = SQLiteStateStore(path), SQLiteStateStore(path)
+    writer.update_latest("0102", ROWS, "D1", "/t/D1")
+    assert reader.get_latest("D1")["parsed"] == ROWS
+    writer.close()
+    reader.close()
+
+
+def test_sqlite_close_closes_every_thread_connection(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    thread = threading.Thread(target=store.update_latest, args=("01", ROWS, "D1", "/t"))
+    thread.start()
+    thread.join()
+    assert len(store._conns) == 2
+    store.close()
+    assert store._conns == []
+    # Usable again afterwards, with a fresh connection
+    assert store.get_latest("D1")["raw"] == "01"
+    store.close()
+
+
+def test_alerts_are_recorded_once_per_dedup_key(store):
+    assert store.add_alert({"rule_id": "hot", "fired_at": 1.0}, "hot|D1|1.0")
+    assert not store.add_alert({"rule_id": "hot", "fired_at": 1.0}, "hot|D1|1.0")
+    assert store.add_alert({"rule_id": "hot", "fired_at": 2.0}, "hot|D1|2.0")
+    assert [a["fired_at"] for a in store.get_alerts()] == [2.0, 1.0]
+    assert store.get_alerts(limit=0) == []
+
+
+def test_quarantine_round_trip(store):
+    store.add_quarantined("D1", "/t/D1", "01", "short_packet")
+    store.add_quarantined("D1", "/t/D1", "0G02", "bad_field:TEMP")
+    store.add_quarantined("D2", "/t/D2", "X" * 2000, "bad_field:FLAGS")
+
+    packets = store.get_quarantined("D1")
+    assert [p["reason"] for p in packets] == ["bad_field:TEMP", "short_packet"]
+    assert packets[0]["topic"] == "/t/D1"
+    newest = store.get_quarantined(limit=1)[0]
+    assert newest["device_id"] == "D2"
+    assert newest["length"] == 2000 and len(newest["raw"]) == 512
+    assert store.get_quarantined(limit=0) == []
+
+    counters = store.get_quarantine_counters()
+    assert counters["D1"]["total"] == 2
+    assert counters["D1"]["reasons"] == {"short_packet": 1, "bad_field": 1}
+    assert counters["D2"]["reasons"] == {"bad_field": 1}
+    assert counters["D2"]["last_at"] is not None
+
+
+def test_sqlite_quarantine_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer, reader = SQLiteStateStore(path), SQLiteStateStore(path)
+    writer.add_quarantined("D1", "/t/D1", "01", "short_packet")
+    assert reader.get_quarantine_counters()["D1"]["total"] == 1
+    writer.close()
+    reader.close()